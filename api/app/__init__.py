@@ -44,11 +44,31 @@ def create_app(config_object='app.config.Config'):
     from .controllers.users_controller import api as users_api
     from .controllers.roles_controller import api as roles_api
     from .controllers.receipts_controller import api as receipts_api
+    from .controllers.batch_receipt_controller import api as batches_api
+    from .controllers.exports_controller import api as exports_api
 
     # Add namespaces with the '/api' prefix
     api.add_namespace(auth_api, path=f'{api_prefix}/auth')
     api.add_namespace(users_api, path=f'{api_prefix}/users')
     api.add_namespace(roles_api, path=f'{api_prefix}/roles')
     api.add_namespace(receipts_api, path=f'{api_prefix}/receipts')
+    api.add_namespace(batches_api, path=f'{api_prefix}/batches')
+    api.add_namespace(exports_api, path=f'{api_prefix}/exports')
+
+    # CLI: `flask check-query-plans` guards the receipts hot-query indexes
+    from .utils.query_plan_check import check_query_plans_command
+    app.cli.add_command(check_query_plans_command)
+
+    # CLI: `flask backfill-ocr-fields` moves EAV OCR details into JSONB
+    from .utils.ocr_backfill import backfill_ocr_fields_command
+    app.cli.add_command(backfill_ocr_fields_command)
+
+    # CLI: `flask ocr-normalization-report` compares confidence across normalization arms
+    from .utils.ocr_normalization import ocr_normalization_report_command
+    app.cli.add_command(ocr_normalization_report_command)
+
+    # CLI: `flask export-receipts-columnar` writes receipts and OCR fields to Parquet/Arrow for analytics
+    from .utils.columnar_export import export_receipts_columnar_command
+    app.cli.add_command(export_receipts_columnar_command)
 
     return app
\ No newline at end of file
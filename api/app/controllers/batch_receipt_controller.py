@@ -1,66 +1,211 @@
-# controllers/batch_controller.py
-from flask_restx import Namespace, Resource, fields
-from flask import request, current_app
-from app.models import Batch, Receipt, db
-import os
-import uuid
-from .receipt_controller import process_single_file  # Reuse your existing logic
+from flask_restx import Namespace, Resource
+from flask import request, abort, current_app
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+from werkzeug.wsgi import get_input_stream
+from sqlalchemy import func
+
+from app import db
+from app.models import Batch, Receipt, Upload
+from app.utils.image_store import get_image_store
+from app.utils.receipt_export import EXPORT_ENCODINGS, export_query, yayoi_csv_response
+from app.utils.receipt_queue import notify_uploads_queued
+from .receipts_controller import ALLOWED_EXTENSIONS
 
 api = Namespace('batches', description='Batch operations')
 
+# Documents the form for Swagger only; the body is parsed incrementally in BatchController.post
 upload_parser = api.parser()
 upload_parser.add_argument('files', location='files', type=FileStorage, required=True, action='append')
 
+export_parser = api.parser()
+export_parser.add_argument('encoding', choices=tuple(EXPORT_ENCODINGS), default='utf-8-sig', location='args',
+                           help='utf-8-sig (Excel) or shift_jis (Yayoi)')
+
+# Multipart body is read and handed to the store in chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Upload statuses and receipt OCR statuses that mean a batch still has work queued
+PENDING_UPLOAD_STATUSES = ('queued', 'segmenting')
+PENDING_OCR_STATUSES = ('pending', 'processing', 'failed')
+
+
+def iter_file_events(stream, boundary, max_parts):
+    """Yield the File and Data events of a multipart body as it is read.
+
+    Only one chunk of the body is in memory at a time; plain form fields are
+    skipped. Raises ValueError if the body ends before the closing boundary,
+    so a truncated upload is never mistaken for a complete one.
+    """
+    decoder = MultipartDecoder(boundary, max_parts=max_parts)
+    in_file = False
+    while True:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                in_file = True
+                yield event
+            elif isinstance(event, Data):
+                if in_file:
+                    yield event
+                if not event.more_data:
+                    in_file = False
+            else:
+                in_file = False
+            event = decoder.next_event()
+        if isinstance(event, Epilogue):
+            return
+        if not chunk:
+            raise ValueError("Upload ended before the closing multipart boundary")
+
+
+def batch_progress(batch):
+    """Per-status upload and receipt counts for `batch`, and the overall state."""
+    upload_counts = dict(db.session.query(
+        Upload.status, func.count()
+    ).filter(Upload.batch_id == batch.batch_id).group_by(Upload.status).all())
+
+    ocr_counts = dict(db.session.query(
+        Receipt.ocr_status, func.count()
+    ).filter(Receipt.batch_id == batch.batch_id).group_by(Receipt.ocr_status).all())
+
+    if batch.status in ('uploading', 'incomplete'):
+        state = batch.status
+    elif any(upload_counts.get(s) for s in PENDING_UPLOAD_STATUSES) or any(ocr_counts.get(s) for s in PENDING_OCR_STATUSES):
+        state = 'processing'
+    else:
+        state = 'completed'
+
+    return {
+        'batch_id': batch.batch_id,
+        'status': state,
+        'files': sum(upload_counts.values()),
+        'upload_status_counts': upload_counts,
+        'receipts': sum(ocr_counts.values()),
+        'ocr_status_counts': ocr_counts,
+        'created_at': batch.created_at.isoformat()
+    }
+
+
 @api.route('/')
 class BatchController(Resource):
     @api.expect(upload_parser)
     def post(self):
-        """Upload and process a batch of receipts"""
-        args = upload_parser.parse_args()
-        uploaded_files = args.get('files')
+        """Upload a batch of receipt files for background segmentation and OCR.
 
-        # Create batch record
-        new_batch = Batch(user_id=8)  # Hardcoded user for example
-        db.session.add(new_batch)
+        Each file is streamed from the request body straight into the image
+        store and queued for segmentation as soon as it has been received,
+        so workers start on the first files while the rest are uploading.
+        """
+        mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+        boundary = options.get('boundary', '').encode('latin-1')
+        if mimetype != 'multipart/form-data' or not boundary:
+            return {'message': 'Expected a multipart/form-data body'}, 400
+
+        config = current_app.config
+        store = get_image_store(current_app)
+        # The batch limit replaces the single-upload MAX_CONTENT_LENGTH, which still applies per file
+        stream = get_input_stream(request.environ, max_content_length=config['BATCH_MAX_CONTENT_LENGTH'])
+
+        batch = Batch(user_id=8, status='uploading')  # Hardcoded user for example
+        db.session.add(batch)
         db.session.commit()
 
-        # Process files asynchronously (use Celery in production)
-        for file in uploaded_files:
-            filename = f"batch_{new_batch.batch_id}_{secure_filename(file.filename)}"
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            # Process each file (reuse your existing code)
-            receipts = process_single_file(file_path, new_batch.batch_id)
-            
-            # Update batch status
-            new_batch.status = 'processing'
+        accepted, rejected = [], []
+        writer = None
+        try:
+            for event in iter_file_events(stream, boundary, max_parts=config['BATCH_MAX_FILES']):
+                if isinstance(event, File):
+                    original_filename = event.filename
+                    filename = secure_filename(original_filename or '')
+                    file_extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+                    if file_extension in ALLOWED_EXTENSIONS:
+                        writer = store.open_blob()
+                    else:
+                        rejected.append({'filename': original_filename, 'reason': 'Unsupported file type'})
+                    continue
+
+                if writer is None:
+                    continue
+
+                writer.write(event.data)
+                if writer.size > config['MAX_CONTENT_LENGTH']:
+                    writer.discard()
+                    writer = None
+                    rejected.append({'filename': original_filename, 'reason': 'File too large'})
+                    continue
+                if event.more_data:
+                    continue
+
+                if writer.size == 0:
+                    writer.discard()
+                    writer = None
+                    rejected.append({'filename': original_filename, 'reason': 'Empty file'})
+                    continue
+
+                file_key, _ = writer.commit(file_extension)
+                writer = None
+
+                # Committed per file so segmentation starts while the rest of the batch uploads
+                upload = Upload(
+                    user_id=batch.user_id,
+                    batch_id=batch.batch_id,
+                    original_filename=original_filename,
+                    file_path=file_key
+                )
+                db.session.add(upload)
+                notify_uploads_queued()
+                db.session.commit()
+                accepted.append({'upload_id': upload.upload_id, 'filename': original_filename})
+
+        except Exception as e:
+            if writer is not None:
+                writer.discard()
+            db.session.rollback()
+            batch.status = 'incomplete'
             db.session.commit()
+            if isinstance(e, HTTPException):
+                raise
+            return {
+                'message': f"Upload interrupted: {str(e)}",
+                'batch_id': batch.batch_id,
+                'accepted': accepted,
+                'rejected': rejected
+            }, 400
 
-        new_batch.status = 'completed'
+        batch.status = 'queued'
         db.session.commit()
 
-        return {'batch_id': new_batch.batch_id, 'status': new_batch.status}, 201
+        return {
+            'message': 'Batch accepted for processing',
+            'batch_id': batch.batch_id,
+            'status': batch.status,
+            'accepted': accepted,
+            'rejected': rejected,
+            'status_url': self.api.url_for(BatchProgress, batch_id=batch.batch_id)
+        }, 202
+
+
+@api.route('/<int:batch_id>')
+class BatchProgress(Resource):
+    def get(self, batch_id):
+        """Progress of a batch: per-status counts of its files and receipts"""
+        batch = Batch.query.get(batch_id)
+        if not batch:
+            abort(404, description="Batch not found")
+        return batch_progress(batch), 200
+
 
 @api.route('/<int:batch_id>/export')
 class BatchExport(Resource):
+    @api.expect(export_parser)
     def get(self, batch_id):
-        """Export batch to Yayoi-compatible CSV"""
-        batch = Batch.query.get_or_404(batch_id)
-        receipts = Receipt.query.filter_by(batch_id=batch_id).all()
-
-        # Generate CSV with ShiftJIS encoding
-        csv_data = "Date,Amount (JPY),Vendor,Status\n"
-        for receipt in receipts:
-            date = receipt.receipt_date.strftime("%Y/%m/%d")
-            amount = str(receipt.total_amount)
-            status = "⚠️ CHECK" if receipt.is_flagged else "✅ OK"
-            csv_data += f"{date},{amount},{receipt.vendor},{status}\n"
-
-        # Use UTF-8 with BOM for Japanese Excel
-        csv_data = '\ufeff' + csv_data
-        return Response(
-            csv_data,
-            mimetype="text/csv",
-            headers={"Content-disposition": f"attachment; filename=batch_{batch_id}.csv"}
-        )
\ No newline at end of file
+        """Export batch to Yayoi-compatible CSV, streamed"""
+        args = export_parser.parse_args()
+        Batch.query.get_or_404(batch_id)
+        return yayoi_csv_response(export_query(batch_id=batch_id), f"batch_{batch_id}.csv", args['encoding'])
@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+from flask_restx import Namespace, Resource, fields, inputs
+from flask import Response, abort, current_app, stream_with_context
+
+from app import db
+from app.models import ExportWatermark, Receipt
+from app.utils.change_feed import CHANGE_CLOCKS, ChangeFeedPage, iter_json_changes
+from app.utils.pagination import decode_cursor
+from app.utils.receipt_export import EXPORT_ENCODINGS, iter_rows, iter_yayoi_csv
+
+api = Namespace('exports', description='Incremental accounting exports')
+
+changes_parser = api.parser()
+changes_parser.add_argument('consumer', type=str, location='args',
+                            help='Resume from this consumer\'s stored watermark when no cursor is given')
+changes_parser.add_argument('cursor', type=str, location='args', help='next_cursor of the previous page; omit to start from the beginning')
+changes_parser.add_argument('clock', choices=tuple(CHANGE_CLOCKS), location='args',
+                            help='updated (any change) or ocr_completed (new OCR results); defaults to the watermark\'s clock or updated')
+changes_parser.add_argument('format', choices=('csv', 'json'), default='csv', location='args')
+changes_parser.add_argument('encoding', choices=tuple(EXPORT_ENCODINGS), default='utf-8-sig', location='args',
+                            help='CSV only: utf-8-sig (Excel) or shift_jis (Yayoi)')
+changes_parser.add_argument('limit', type=inputs.int_range(1, 100000), default=10000, location='args')
+
+watermark_model = api.model('ExportWatermark', {
+    'cursor': fields.String(required=True, description='next_cursor of the last page the consumer imported'),
+    'clock': fields.String(enum=list(CHANGE_CLOCKS), default='updated'),
+})
+
+
+def watermark_json(watermark):
+    return {
+        'consumer': watermark.consumer,
+        'clock': watermark.clock,
+        'cursor': watermark.cursor,
+        'updated_at': watermark.updated_at.isoformat() if watermark.updated_at else None
+    }
+
+
+@api.route('/changes')
+class ChangeFeed(Resource):
+    @api.expect(changes_parser)
+    def get(self):
+        """Stream receipts created or modified since a cursor, as Yayoi CSV or JSON.
+
+        Pages are in change order. `next_cursor` (the X-Next-Cursor header for
+        CSV) resumes after the last row; keep requesting while `has_more` is
+        true, then store the cursor with PUT /watermarks/<consumer>.
+        """
+        args = changes_parser.parse_args()
+        cursor, clock = args['cursor'], args['clock']
+        if not cursor and args['consumer']:
+            watermark = db.session.get(ExportWatermark, args['consumer'])
+            if watermark:
+                cursor = watermark.cursor
+                clock = clock or watermark.clock
+
+        lag = timedelta(seconds=current_app.config['EXPORT_CHANGE_FEED_LAG_SECONDS'])
+        try:
+            page = ChangeFeedPage(clock or 'updated', cursor, args['limit'], lag)
+        except ValueError:
+            abort(400, description="Invalid cursor")
+
+        headers = {'X-Has-More': 'true' if page.has_more else 'false'}
+        if page.next_cursor:
+            headers['X-Next-Cursor'] = page.next_cursor
+
+        rows = iter_rows(page.query())
+        if args['format'] == 'json':
+            return Response(stream_with_context(iter_json_changes(page, rows)),
+                            content_type='application/json', headers=headers)
+
+        _, charset = EXPORT_ENCODINGS[args['encoding']]
+        headers['Content-disposition'] = "attachment; filename=receipt_changes.csv"
+        return Response(stream_with_context(iter_yayoi_csv(rows, args['encoding'])),
+                        content_type=f'text/csv; charset={charset}', headers=headers)
+
+
+@api.route('/watermarks/<string:consumer>')
+class Watermark(Resource):
+    def get(self, consumer):
+        """Stored position of an export consumer"""
+        watermark = db.session.get(ExportWatermark, consumer)
+        if not watermark:
+            abort(404, description="Watermark not found")
+        return watermark_json(watermark), 200
+
+    @api.expect(watermark_model)
+    def put(self, consumer):
+        """Acknowledge an imported page: the next export for this consumer resumes after `cursor`"""
+        data = api.payload or {}
+        clock = data.get('clock') or 'updated'
+        if clock not in CHANGE_CLOCKS:
+            abort(400, description="Invalid clock")
+        cursor = data.get('cursor')
+        try:
+            if not cursor:
+                raise ValueError("Missing cursor")
+            decode_cursor(cursor, (CHANGE_CLOCKS[clock], Receipt.receipt_id))
+        except ValueError:
+            abort(400, description="Invalid cursor")
+
+        watermark = db.session.get(ExportWatermark, consumer)
+        if watermark is None:
+            watermark = ExportWatermark(consumer=consumer)
+            db.session.add(watermark)
+        watermark.clock = clock
+        watermark.cursor = cursor
+        db.session.commit()
+        return watermark_json(watermark), 200
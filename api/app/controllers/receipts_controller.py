@@ -1,18 +1,23 @@
 import os
-import cv2
-import numpy as np
-from flask_restx import Namespace, Resource
-from flask import request, abort, send_from_directory
+from flask_restx import Namespace, Resource, fields, inputs
+from flask import request, abort, send_file, current_app
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
-from datetime import datetime
-import tempfile
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 
 from app import db
-from app.models import Receipt, OcrBase, OcrDetails
-from pdf2image import convert_from_path
-from google.cloud import documentai
-from app.utils.ocr_utils import perform_ocr_with_document_ai
+from app.models import Receipt, OcrBase, Upload
+from app.utils.image_store import get_image_store
+from app.utils.ocr_normalization import get_ocr_normalizer
+from app.utils.ocr_utils import get_ocr_backend, run_ocr
+from app.utils.ocr_cache import get_ocr_cache
+from app.utils.ocr_persistence import save_ocr_result, ocr_fields
+from app.utils.pagination import keyset_paginate, approximate_count
+from app.utils.receipt_queries import RECEIPT_LIST_KEY, REVIEW_QUEUE_KEY, review_queue_query
+from app.utils.receipt_export import EXPORT_ENCODINGS, export_query, yayoi_csv_response
+from app.utils.receipt_queue import dead_letters_query, notify_uploads_queued, requeue_dead_letters
+from app.utils.thumbnails import delete_thumbnails, ensure_thumbnail, thumbnail_bucket
 
 api = Namespace('receipts', description="Receipt operations")
 
@@ -27,49 +32,57 @@ upload_parser.add_argument(
     help='Receipt image file (png, jpg, jpeg, gif, pdf)'
 )
 
+preview_parser = api.parser()
+preview_parser.add_argument('size', type=inputs.positive, location='args', help='Thumbnail long edge in px (rounded up to 160, 320 or 640); omit for the full image')
+
+export_parser = api.parser()
+export_parser.add_argument('encoding', choices=tuple(EXPORT_ENCODINGS), default='utf-8-sig', location='args',
+                           help='utf-8-sig (Excel) or shift_jis (Yayoi)')
+export_parser.add_argument('user_id', type=int, location='args')
+export_parser.add_argument('batch_id', type=int, location='args')
+export_parser.add_argument('date_from', type=inputs.date_from_iso8601, location='args', help='Receipt date on or after (YYYY-MM-DD)')
+export_parser.add_argument('date_to', type=inputs.date_from_iso8601, location='args', help='Receipt date before (YYYY-MM-DD)')
+
+# Content-addressed images never change, so clients may cache them for a year without revalidating
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+cursor_page_parser = api.parser()
+cursor_page_parser.add_argument('cursor', type=str, location='args', help='next_cursor from the previous page; empty for the first page')
+cursor_page_parser.add_argument('per_page', type=inputs.int_range(1, 200), default=10, location='args')
+
+dead_letter_parser = api.parser()
+dead_letter_parser.add_argument('page', type=inputs.positive, default=1, location='args')
+dead_letter_parser.add_argument('per_page', type=inputs.int_range(1, 200), default=10, location='args')
+
+review_queue_parser = api.parser()
+review_queue_parser.add_argument('cursor', type=str, location='args', help='next_cursor from the previous page')
+review_queue_parser.add_argument('per_page', type=inputs.int_range(1, 200), default=50, location='args')
+review_queue_parser.add_argument('min_confidence', type=float, location='args')
+review_queue_parser.add_argument('max_confidence', type=float, location='args')
+review_queue_parser.add_argument('user_id', type=int, location='args')
+review_queue_parser.add_argument('batch_id', type=int, location='args')
+review_queue_parser.add_argument('date_from', type=inputs.datetime_from_iso8601, location='args', help='Uploaded at or after (ISO 8601)')
+review_queue_parser.add_argument('date_to', type=inputs.datetime_from_iso8601, location='args', help='Uploaded before (ISO 8601)')
+
+requeue_model = api.model('DeadLetterRequeue', {
+    'receipt_ids': fields.List(fields.Integer, description='Receipts to requeue; omit to requeue every dead-lettered receipt'),
+})
+
+def serialize_receipt(r):
+    return {
+        'receipt_id': r.receipt_id,
+        'user_id': r.user_id,
+        'receipt_image_url': r.receipt_image_url,
+        'is_ocr_extracted': r.is_ocr_extracted,
+        'confidence_score': r.confidence_score,
+        'total_amount': str(r.total_amount),
+        'created_at': r.created_at.isoformat(),
+        'updated_at': r.updated_at.isoformat()
+    }
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def detect_receipt_contours(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    edged = cv2.Canny(blurred, 50, 200)
-    contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:10]
-
-    receipts = []
-    min_area = 50000
-
-    for contour in contours:
-        peri = cv2.arcLength(contour, True)
-        approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
-        if len(approx) == 4 and cv2.contourArea(contour) > min_area:
-            x, y, w, h = cv2.boundingRect(contour)
-            aspect_ratio = w / float(h)
-            if 0.2 <= aspect_ratio <= 5:
-                receipt = image[y:y+h, x:x+w]
-                receipts.append(receipt)
-
-    return receipts
-
-def segment_receipts(image):
-    receipts = detect_receipt_contours(image)
-    return receipts or grid_segment_receipts(image, rows=2, cols=3)
-
-def grid_segment_receipts(image, rows, cols):
-    height, width, _ = image.shape
-    cell_height = height // rows
-    cell_width = width // cols
-
-    return [
-        image[i * cell_height:(i + 1) * cell_height, j * cell_width:(j + 1) * cell_width]
-        for i in range(rows) for j in range(cols)
-    ]
-
-def convert_pdf_to_images(pdf_path):
-    return convert_from_path(pdf_path)
-
-
 # ---------------- Controller ---------------- #
 
 @api.route('/')
@@ -91,84 +104,95 @@ class ReceiptController(Resource):
         if file_extension not in ALLOWED_EXTENSIONS:
             return {'message': 'Unsupported file type'}, 400
 
-        upload_folder = os.path.join(self.app.root_path, 'uploads', 'receipts')
-        os.makedirs(upload_folder, exist_ok=True)
-        file_path = os.path.join(upload_folder, filename)
-
+        # Stored under its content hash, so identical uploads share one file
         try:
-            file.save(file_path)
+            file_key, _ = get_image_store(self.app).put_stream(file.stream, file_extension)
         except Exception as e:
             return {'message': f"Failed to save file: {str(e)}"}, 500
 
-        try:
-            receipt_images = []
-            if file_extension in ['png', 'jpg', 'jpeg']:
-                image = cv2.imread(file_path)
-                receipt_images = segment_receipts(image)
-            elif file_extension == 'pdf':
-                pdf_images = convert_pdf_to_images(file_path)
-                for pdf_image in pdf_images:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_img:
-                        pdf_image.save(temp_img.name)
-                        image = cv2.imread(temp_img.name)
-                        receipt_images.extend(segment_receipts(image))
-
-            saved_receipts = []
-            for i, receipt_img in enumerate(receipt_images):
-                base_filename, _ = os.path.splitext(filename)
-                extracted_filename = f"{base_filename}_{i+1}.jpg"
-                extracted_path = os.path.join(upload_folder, extracted_filename)
-                cv2.imwrite(extracted_path, receipt_img)
-
-                new_receipt = Receipt(
-                    user_id=3,  # TODO: Replace with actual user
-                    receipt_date=datetime.now(),
-                    total_amount=99.99,
-                    receipt_image_url=extracted_filename,
-                    is_ocr_extracted=0
-                )
-                db.session.add(new_receipt)
-                db.session.commit()
-
-                saved_receipts.append(extracted_filename)
-
-            return {
-                'message': 'Receipts processed and saved successfully',
-                'saved_receipts': saved_receipts
-            }, 201
+        # Segmentation runs in the segmentation worker; the client polls the upload status
+        upload = Upload(
+            user_id=3,  # TODO: Replace with actual user
+            original_filename=file.filename,
+            file_path=file_key
+        )
+        db.session.add(upload)
+        notify_uploads_queued()
+        db.session.commit()
 
-        except Exception as e:
-            db.session.rollback()
-            return {'message': f"Failed to process receipt: {str(e)}"}, 500
+        return {
+            'message': 'Upload accepted for processing',
+            'upload_id': upload.upload_id,
+            'status': upload.status,
+            'status_url': self.api.url_for(UploadStatus, upload_id=upload.upload_id)
+        }, 202
 
     def get(self):
         # Extract pagination params from query string
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
 
+        # Any `cursor` parameter (empty for the first page) selects keyset pagination
+        if 'cursor' in request.args:
+            args = cursor_page_parser.parse_args()
+            return self.get_by_cursor(args['cursor'] or '', args['per_page'])
+
         # Query with ordering by updated_at then created_at (both descending)
         paginated = Receipt.query.order_by(
-            Receipt.updated_at.desc(),
-            Receipt.created_at.desc()
+            *[column.desc() for column in RECEIPT_LIST_KEY]
         ).paginate(page=page, per_page=per_page, error_out=False)
 
-        results = [{
-            'receipt_id': r.receipt_id,
-            'user_id': r.user_id,
-            'receipt_image_url': r.receipt_image_url,
-            'is_ocr_extracted': r.is_ocr_extracted,
-            'confidence_score': r.confidence_score,
-            'total_amount': str(r.total_amount),
-            'created_at': r.created_at.isoformat(),
-            'updated_at': r.updated_at.isoformat()
-        } for r in paginated.items]
-
         return {
             'total': paginated.total,
             'pages': paginated.pages,
             'current_page': paginated.page,
             'per_page': paginated.per_page,
-            'receipts': results
+            'receipts': [serialize_receipt(r) for r in paginated.items]
+        }, 200
+
+    def get_by_cursor(self, cursor, per_page):
+        try:
+            receipts, next_cursor = keyset_paginate(
+                Receipt.query,
+                RECEIPT_LIST_KEY,
+                cursor=cursor,
+                per_page=per_page
+            )
+        except ValueError:
+            return {'message': 'Invalid cursor'}, 400
+
+        response = {
+            'per_page': per_page,
+            'next_cursor': next_cursor,
+            'receipts': [serialize_receipt(r) for r in receipts]
+        }
+        # Exact totals need a full COUNT(*); only the planner estimate is offered here
+        if request.args.get('total') == 'approximate':
+            response['approximate_total'] = approximate_count(Receipt.__tablename__)
+        return response, 200
+
+
+@api.route('/uploads/<int:upload_id>')
+class UploadStatus(Resource):
+    def get(self, upload_id):
+        upload = Upload.query.get(upload_id)
+        if not upload:
+            abort(404, description="Upload not found")
+
+        ocr_counts = dict(db.session.query(
+            Receipt.ocr_status, func.count()
+        ).filter(Receipt.upload_id == upload_id).group_by(Receipt.ocr_status).all())
+
+        return {
+            'upload_id': upload.upload_id,
+            'original_filename': upload.original_filename,
+            'status': upload.status,
+            'error_message': upload.error_message,
+            'receipt_count': upload.receipt_count,
+            'blank_crop_count': upload.blank_crop_count,
+            'ocr_status_counts': ocr_counts,
+            'created_at': upload.created_at.isoformat(),
+            'updated_at': upload.updated_at.isoformat()
         }, 200
 
 
@@ -193,13 +217,15 @@ class ReceiptDetailController(Resource):
         if not receipt:
             abort(404, description="Receipt not found")
 
-        upload_folder = os.path.join(self.api.app.root_path, 'uploads', 'receipts')
-        file_path = os.path.join(upload_folder, receipt.receipt_image_url)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
+        image_key = receipt.receipt_image_url
         db.session.delete(receipt)
         db.session.commit()
+
+        # Crops are deduplicated, so only remove the file once nothing else points at it
+        if image_key and not Receipt.query.filter_by(receipt_image_url=image_key).first():
+            store = get_image_store(self.api.app)
+            store.delete(image_key)
+            delete_thumbnails(store, image_key, self.api.app.config['THUMBNAIL_FORMAT'])
         return {'message': 'Receipt deleted successfully'}, 200
 
 
@@ -212,33 +238,131 @@ class FlagReceipt(Resource):
         return {'message': 'Receipt flagged for review'}
 
 
-@api.route('/flagged')
+@api.route('/flagged', '/review-queue')
 class FlaggedReceipts(Resource):
+    @api.expect(review_queue_parser)
+    def get(self):
+        """Flagged receipts for review, lowest confidence first, one cursor page at a time"""
+        args = review_queue_parser.parse_args()
+        query = review_queue_query(args['min_confidence'], args['max_confidence'], args['user_id'],
+                                   args['batch_id'], args['date_from'], args['date_to'])
+
+        try:
+            flagged, next_cursor = keyset_paginate(
+                query,
+                REVIEW_QUEUE_KEY,
+                cursor=args['cursor'],
+                per_page=args['per_page'],
+                descending=False,
+                row_key=lambda r: [r.confidence_score or 0, r.receipt_id]
+            )
+        except ValueError:
+            return {'message': 'Invalid cursor'}, 400
+
+        return {
+            'per_page': args['per_page'],
+            'next_cursor': next_cursor,
+            'receipts': [{
+                'receipt_id': r.receipt_id,
+                'user_id': r.user_id,
+                'batch_id': r.batch_id,
+                'confidence': r.confidence_score,
+                'image_url': r.receipt_image_url,
+                'created_at': r.created_at.isoformat()
+            } for r in flagged]
+        }, 200
+
+
+@api.route('/dead-letter')
+class DeadLetterReceipts(Resource):
+    @api.expect(dead_letter_parser)
+    def get(self):
+        args = dead_letter_parser.parse_args()
+        paginated = dead_letters_query().paginate(page=args['page'], per_page=args['per_page'], error_out=False)
+
+        return {
+            'total': paginated.total,
+            'pages': paginated.pages,
+            'current_page': paginated.page,
+            'per_page': paginated.per_page,
+            'receipts': [{
+                'receipt_id': r.receipt_id,
+                'user_id': r.user_id,
+                'receipt_image_url': r.receipt_image_url,
+                'ocr_attempts': r.ocr_attempts,
+                'last_ocr_attempt': r.last_ocr_attempt.isoformat() if r.last_ocr_attempt else None,
+                'ocr_error_message': r.ocr_error_message
+            } for r in paginated.items]
+        }, 200
+
+
+@api.route('/dead-letter/requeue')
+class RequeueDeadLetterReceipts(Resource):
+    @api.expect(requeue_model)
+    def post(self):
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return {'message': 'Expected a JSON object'}, 400
+
+        receipt_ids = data.get('receipt_ids')
+        if receipt_ids is not None and not (
+            isinstance(receipt_ids, list)
+            and all(isinstance(i, int) and not isinstance(i, bool) and 0 < i < 2 ** 31 for i in receipt_ids)
+        ):
+            return {'message': 'receipt_ids must be a list of receipt ids'}, 400
+
+        requeued = requeue_dead_letters(receipt_ids)
+        db.session.commit()
+        return {'message': 'Receipts requeued for OCR', 'requeued': requeued}, 200
+
+
+@api.route('/export')
+class ReceiptExport(Resource):
+    @api.expect(export_parser)
     def get(self):
-        flagged = Receipt.query.filter_by(is_flagged=True).all()
-        return [{
-            'receipt_id': r.receipt_id,
-            'confidence': r.confidence_score,
-            'image_url': r.receipt_image_url
-        } for r in flagged]
+        """Stream receipts as Yayoi CSV, filtered by user, batch and receipt date range"""
+        args = export_parser.parse_args()
+        query = export_query(
+            batch_id=args['batch_id'],
+            user_id=args['user_id'],
+            date_from=args['date_from'],
+            date_to=args['date_to']
+        )
+        return yayoi_csv_response(query, "receipts.csv", args['encoding'])
 
 
-@api.route('/preview/<string:filename>')
+@api.route('/preview/<path:filename>')
 class ReceiptImagePreview(Resource):
     def __init__(self, api=None, *args, **kwargs):
         super().__init__(api=api, *args, **kwargs)
         self.app = api.app
 
 
+    @api.expect(preview_parser)
     def get(self, filename):
-        upload_folder = os.path.join(self.app.root_path, 'uploads', 'receipts')
-        file_path = os.path.join(upload_folder, filename)
+        args = preview_parser.parse_args()
+        store = get_image_store(self.app)
+        fmt = self.app.config['THUMBNAIL_FORMAT']
+        size = thumbnail_bucket(args['size']) if args['size'] else None
 
-        if not os.path.exists(file_path):
+        try:
+            path = ensure_thumbnail(store, filename, size, fmt) if size else store.path(filename)
+            digest = store.digest_of(filename)
+            if digest is None:
+                # Legacy flat files can be overwritten, so let clients cache but always revalidate
+                response = send_file(path, conditional=True)
+                response.cache_control.no_cache = True
+                return response
+
+            # send_file answers If-None-Match with 304 and Range requests with 206
+            etag = f"{digest}-{size}.{fmt}" if size else digest
+            response = send_file(path, conditional=True, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+            return response
+        except (ValueError, FileNotFoundError):
             abort(404, description="Image file not found")
 
-        return send_from_directory(upload_folder, filename)
-
 @api.route('/<int:receipt_id>/ocr')
 class PerformOCRController(Resource):
     def __init__(self, api=None, *args, **kwargs):
@@ -252,22 +376,24 @@ class PerformOCRController(Resource):
         if not receipt:
             abort(404, description="Receipt not found")
 
-        upload_folder = os.path.join(self.app.root_path, 'uploads', 'receipts')
-        file_path = os.path.join(upload_folder, receipt.receipt_image_url)
-
-        if not os.path.exists(file_path):
+        store = get_image_store(self.app)
+        if not store.exists(receipt.receipt_image_url):
             abort(404, description="Receipt image file not found")
-
-        ocr_data = perform_ocr_with_document_ai(file_path)
-
-        receipt.confidence_score = ocr_data['avg_confidence']
-        receipt.is_flagged = ocr_data['avg_confidence'] < 0.95
-        receipt.is_ocr_extracted = True
-        if ocr_data['total_amount'] is not None:
-            receipt.total_amount = ocr_data['total_amount']
-
-        # Save OCR results to the database using the utility function
-        self.save_ocr_data(receipt_id, ocr_data)
+        file_path = store.path(receipt.receipt_image_url)
+
+        # Identical image bytes reuse the cached OCR result instead of a paid call
+        ocr_cache = get_ocr_cache(current_app.config)
+        content_hash = ocr_cache.content_hash(file_path) if ocr_cache else None
+        ocr_data = ocr_cache.get(content_hash) if ocr_cache else None
+        if ocr_data is not None:
+            ocr_data.update(cached=True, latency_ms=0.0)
+        else:
+            ocr_data = run_ocr(get_ocr_backend(current_app.config), file_path, get_ocr_normalizer(current_app.config))
+            if ocr_cache:
+                ocr_cache.put(content_hash, ocr_data)
+
+        # Receipt update and OCR rows are committed in a single transaction
+        save_ocr_result(receipt, ocr_data, storage_mode=current_app.config['OCR_STORAGE_MODE'])
         db.session.commit()
 
         return {
@@ -276,6 +402,9 @@ class PerformOCRController(Resource):
             'confidence': receipt.confidence_score,
             'is_flagged': receipt.is_flagged,
             'ocr_results': ocr_data['ocr_results'],
+            'latency_ms': ocr_data['latency_ms'],
+            'cached': ocr_data.get('cached', False),
+            'normalization': ocr_data.get('normalization'),
         }, 200
 
     def get(self, receipt_id):
@@ -283,11 +412,13 @@ class PerformOCRController(Resource):
         if not receipt:
             abort(404, description="Receipt not found")
 
-        ocr_base = OcrBase.query.filter_by(receipt_id=receipt_id).first()
+        # One query: JSONB rows carry their fields, EAV rows bring their details along
+        ocr_base = OcrBase.query.options(
+            joinedload(OcrBase.ocr_details)
+        ).filter_by(receipt_id=receipt_id).order_by(OcrBase.ocr_base_id.desc()).first()
         if not ocr_base:
             return {'message': 'OCR data not found'}, 404
 
-        ocr_details = OcrDetails.query.filter_by(ocr_base_id=ocr_base.ocr_base_id).all()
         return {
             'ocr_base': {
                 'ocr_base_id': ocr_base.ocr_base_id,
@@ -296,34 +427,9 @@ class PerformOCRController(Resource):
                 'modified_by': ocr_base.modified_by
             },
             'ocr_details': [{
-                'field_type': d.field_type,
-                'text_value': d.text_value,
-                'normalized_value': d.normalized_value,
-                'confidence': d.confidence
-            } for d in ocr_details]
+                'field_type': f['type'],
+                'text_value': f['text_value'],
+                'normalized_value': f['normalized_value'],
+                'confidence': f['confidence']
+            } for f in ocr_fields(ocr_base)]
         }, 200
-
-    def save_ocr_data(receipt_id, ocr_data, created_by=3, modified_by=3):
-        # Create the OcrBase entry
-        ocr_base = OcrBase(
-            receipt_id=receipt_id,
-            created_by=created_by,
-            modified_by=modified_by
-        )
-        db.session.add(ocr_base)
-        db.session.commit()
-
-        # Create the OcrDetails entries
-        for result in ocr_data['ocr_results']:
-            ocr_detail = OcrDetails(
-                ocr_base_id=ocr_base.ocr_base_id,
-                field_type=result['type'],
-                text_value=result['text_value'],
-                normalized_value=result['normalized_value'],
-                confidence=result['confidence']
-            )
-            db.session.add(ocr_detail)
-
-        db.session.commit()
-
-        return ocr_base.ocr_base_id  # Return the OcrBase ID if needed
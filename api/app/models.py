@@ -1,7 +1,7 @@
 
 from datetime import datetime
 from app import db
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSON, JSONB
 
 # Role model
 class Role(db.Model):
@@ -50,10 +50,36 @@ class Batch(db.Model):
     __tablename__ = 'batches'  # Explicit table name (prevents conflicts)
     batch_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
-    status = db.Column(db.String(20), default='uploaded')
+    status = db.Column(db.String(20), default='uploaded')  # 'uploading', 'queued' or 'incomplete'; progress is derived from its uploads
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     receipts = db.relationship('Receipt', backref='batch')  # Now works
 
+# Upload model: one uploaded file, segmented into receipts by the segmentation worker
+class Upload(db.Model):
+    __tablename__ = 'uploads'
+    upload_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.batch_id'), index=True)
+    original_filename = db.Column(db.String(255))
+    file_path = db.Column(db.String, nullable=False)  # image store key of the uploaded file
+    status = db.Column(db.String(20), default='queued')  # 'queued', 'segmenting', 'done', 'failed'
+    receipt_count = db.Column(db.Integer, default=0)
+    blank_crop_count = db.Column(db.Integer, default=0)  # crops dropped as blank, i.e. OCR calls saved
+    error_message = db.Column(db.Text, nullable=True)
+    segmentation_attempts = db.Column(db.Integer, default=0)
+    claimed_until = db.Column(db.DateTime)  # lease of a 'segmenting' claim; released once it has passed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    receipts = db.relationship('Receipt', backref='upload')
+
+    __table_args__ = (
+        # Segmentation queue: queued uploads in created_at order
+        db.Index('ix_uploads_queue', 'created_at', postgresql_where=db.text("status = 'queued'")),
+        # Claims left behind by segmentation workers that died
+        db.Index('ix_uploads_claim_expiry', claimed_until, postgresql_where=db.text("status = 'segmenting'")),
+    )
+
 # Receipt Model (Fixed)
 class Receipt(db.Model):
     __tablename__ = 'receipts'
@@ -61,40 +87,85 @@ class Receipt(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     
     # ✅ Correct foreign key (matches Batch's table name)
-    batch_id = db.Column(db.Integer, db.ForeignKey('batches.batch_id'))  # Reference 'batches'
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.batch_id'), index=True)  # Reference 'batches'
+    upload_id = db.Column(db.Integer, db.ForeignKey('uploads.upload_id'), index=True)
     
     confidence_score = db.Column(db.Float)
     is_flagged = db.Column(db.Boolean, default=False)
     receipt_date = db.Column(db.DateTime, nullable=False)
     total_amount = db.Column(db.Numeric(10, 2), nullable=False)
-    receipt_image_url = db.Column(db.String)
+    receipt_image_url = db.Column(db.String, index=True)  # image store key of the crop
     is_ocr_extracted = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # NEW fields for background processing
-    ocr_status = db.Column(db.String(20), default='pending')  # 'pending', 'processing', 'done', 'failed'
+    ocr_status = db.Column(db.String(20), default='pending')  # 'pending', 'processing', 'done', 'failed', 'dead_letter'
     ocr_attempts = db.Column(db.Integer, default=0)
     last_ocr_attempt = db.Column(db.DateTime)
+    next_attempt_at = db.Column(db.DateTime)  # earliest retry time for 'failed' receipts
+    claimed_until = db.Column(db.DateTime)  # lease of a 'processing' claim; released once it has passed
     ocr_error_message = db.Column(db.Text, nullable=True)
+    ocr_completed_at = db.Column(db.DateTime)  # when the latest OCR result was saved
 
     user = db.relationship('User', backref='receipts')
 
+    __table_args__ = (
+        # Worker queue: claimable receipts in created_at order
+        db.Index('ix_receipts_ocr_queue', 'created_at',
+                 postgresql_where=db.text("ocr_status IN ('pending', 'failed')")),
+        # GET /api/receipts ordering
+        db.Index('ix_receipts_updated_created', updated_at.desc(), created_at.desc(), receipt_id.desc()),
+        # Review queue: flagged receipts, lowest confidence first (unscored first of all)
+        db.Index('ix_receipts_flagged', db.func.coalesce(confidence_score, 0), receipt_id,
+                 postgresql_where=db.text('is_flagged')),
+        # Incremental export change feeds, one per clock
+        db.Index('ix_receipts_change_feed', updated_at, receipt_id),
+        db.Index('ix_receipts_ocr_completed', ocr_completed_at, receipt_id),
+        # Accounting export by user and receipt date range
+        db.Index('ix_receipts_user_date', user_id, receipt_date, receipt_id),
+        # Claims left behind by workers that died
+        db.Index('ix_receipts_claim_expiry', claimed_until,
+                 postgresql_where=db.text("ocr_status = 'processing'")),
+        # Dead-letter listing
+        db.Index('ix_receipts_dead_letter', 'last_ocr_attempt',
+                 postgresql_where=db.text("ocr_status = 'dead_letter'")),
+    )
+
+# Generated-column expressions over OcrBase.fields (a JSONB list of OCR entities)
+OCR_TOTAL_AMOUNT_SQL = r"""(jsonb_path_query_first(fields, '$[*] ? (@.type == "total_amount" && @.normalized_value like_regex "^-?[0-9]+(\\.[0-9]+)?$").normalized_value') #>> '{}')::numeric(12, 2)"""
+OCR_RECEIPT_DATE_SQL = """jsonb_path_query_first(fields, '$[*] ? (@.type == "receipt_date").normalized_value') #>> '{}'"""
+OCR_VENDOR_SQL = """jsonb_path_query_first(fields, '$[*] ? (@.type == "supplier_name").text_value') #>> '{}'"""
+
 class OcrBase(db.Model):
     __tablename__ = 'ocr_base'
     ocr_base_id = db.Column(db.Integer, primary_key=True)
-    receipt_id = db.Column(db.Integer, db.ForeignKey('receipts.receipt_id'), nullable=False)
+    receipt_id = db.Column(db.Integer, db.ForeignKey('receipts.receipt_id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     modified_by = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
 
+    # JSONB storage mode: the entity list lives here instead of in ocr_details
+    fields = db.Column(JSONB)
+    # Generated from `fields` for the few fields we filter and sort on
+    total_amount = db.Column(db.Numeric(12, 2), db.Computed(OCR_TOTAL_AMOUNT_SQL, persisted=True), index=True)
+    receipt_date = db.Column(db.String, db.Computed(OCR_RECEIPT_DATE_SQL, persisted=True), index=True)  # ISO date as normalized by Document AI
+    vendor = db.Column(db.String, db.Computed(OCR_VENDOR_SQL, persisted=True), index=True)
+
+    # Image normalization before the OCR call: 'normalized', 'skipped' or 'control' (A/B hold-out)
+    normalization = db.Column(db.String(20))
+    source_bytes = db.Column(db.Integer)
+    sent_bytes = db.Column(db.Integer)
+    # Mean entity confidence of this run; Receipt.confidence_score only keeps the latest run's
+    confidence = db.Column(db.Float)
+
     receipt = db.relationship('Receipt', backref='ocr_bases')
 
 class OcrDetails(db.Model):
     __tablename__ = 'ocr_details'
     ocr_details_id = db.Column(db.Integer, primary_key=True)
-    ocr_base_id = db.Column(db.Integer, db.ForeignKey('ocr_base.ocr_base_id'), nullable=False)
+    ocr_base_id = db.Column(db.Integer, db.ForeignKey('ocr_base.ocr_base_id'), nullable=False, index=True)
     field_type = db.Column(db.String(100), nullable=False)  # e.g., 'total_amount', 'purchase_time'
     text_value = db.Column(db.String(255), nullable=False)  # Raw OCR value (e.g., '15:30:05', '836')
     normalized_value = db.Column(db.String(255))  # Normalized value if applicable (e.g., '836' instead of '836 JPY')
@@ -102,6 +173,22 @@ class OcrDetails(db.Model):
 
     ocr_base = db.relationship('OcrBase', backref='ocr_details')
 
+# OCR result cache, keyed by image content hash and processor version
+class OcrCache(db.Model):
+    __tablename__ = 'ocr_cache'
+    content_hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the image bytes
+    processor_version = db.Column(db.String(255), primary_key=True)
+    payload = db.Column(JSON, nullable=False)  # ocr_results, avg_confidence, total_amount
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Incremental export position of a downstream consumer (e.g. the nightly accounting sync)
+class ExportWatermark(db.Model):
+    __tablename__ = 'export_watermarks'
+    consumer = db.Column(db.String(100), primary_key=True)
+    clock = db.Column(db.String(20), nullable=False, default='updated')  # 'updated' or 'ocr_completed'
+    cursor = db.Column(db.String, nullable=False)  # change-feed cursor of the last acknowledged export
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # AuditLog model
 class AuditLog(db.Model):
     __tablename__ = 'audit_logs'
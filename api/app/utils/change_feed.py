@@ -0,0 +1,104 @@
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import false, select, tuple_
+
+from app import db
+from app.models import Receipt
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.receipt_export import EXPORT_CHUNK_SIZE, latest_vendor
+
+# Timestamps a consumer can follow; each is backed by a (clock, receipt_id) index
+CHANGE_CLOCKS = {
+    'updated': Receipt.updated_at,
+    'ocr_completed': Receipt.ocr_completed_at,
+}
+
+
+class ChangeFeedPage:
+    """One page of receipts changed after a cursor, in (clock, receipt_id) order.
+
+    The page bounds are resolved up front with an index-only probe, so
+    `next_cursor` and `has_more` are known before any row is streamed and
+    the rows themselves can go out through a server-side cursor. Only rows
+    whose clock is older than `lag` are included: `updated_at` is stamped
+    when a transaction flushes, not when it commits, so a very recent
+    change may still become visible behind the cursor.
+    """
+
+    def __init__(self, clock='updated', cursor=None, limit=10000, lag=timedelta(seconds=60)):
+        self.clock = clock
+        self.column = CHANGE_CLOCKS[clock]
+        self.key = (self.column, Receipt.receipt_id)
+        self.after = decode_cursor(cursor, self.key) if cursor else None
+        self.horizon = datetime.utcnow() - lag
+
+        self.bound, self.has_more = self._probe(limit)
+        # An empty page leaves the consumer where it was
+        self.next_cursor = encode_cursor(self.bound) if self.bound is not None else cursor
+
+    def _window(self, query):
+        query = query.where(self.column < self.horizon)
+        if self.after is not None:
+            query = query.where(tuple_(*self.key) > tuple_(*self.after))
+        return query
+
+    def bound_query(self, limit):
+        """Keys of the page's last row and the one after it, read from the clock index alone."""
+        return self._window(select(*self.key)).order_by(*self.key).offset(limit - 1).limit(2)
+
+    def _probe(self, limit):
+        """Key of the last row on this page, and whether rows remain after it."""
+        keys = db.session.execute(self.bound_query(limit)).all()
+        if keys:
+            return list(keys[0]), len(keys) > 1
+
+        # Fewer than `limit` rows left: the page ends at the newest change in the window
+        last = db.session.execute(
+            self._window(select(*self.key)).order_by(*[c.desc() for c in self.key]).limit(1)
+        ).first()
+        return (list(last) if last else None), False
+
+    def query(self):
+        """The page's receipts, in the shape `iter_yayoi_csv` expects plus change timestamps."""
+        query = select(
+            Receipt.receipt_id,
+            Receipt.receipt_date,
+            Receipt.total_amount,
+            latest_vendor().label('vendor'),
+            Receipt.is_flagged,
+            Receipt.ocr_status,
+            Receipt.created_at,
+            Receipt.updated_at,
+            Receipt.ocr_completed_at
+        )
+        if self.bound is None:
+            return query.where(false())
+        query = self._window(query).where(tuple_(*self.key) <= tuple_(*self.bound))
+        return query.order_by(*self.key)
+
+
+def _json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def iter_json_changes(page, rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """Encode a change-feed page as one JSON document, yielding a chunk per `chunk_size` rows."""
+    head = json.dumps({'clock': page.clock, 'next_cursor': page.next_cursor, 'has_more': page.has_more})
+    parts = [head[:-1] + ', "receipts": [']
+
+    for count, row in enumerate(rows):
+        if count:
+            parts.append(', ')
+        parts.append(json.dumps({key: _json_value(value) for key, value in row._mapping.items()}))
+        if (count + 1) % chunk_size == 0:
+            yield ''.join(parts).encode()
+            parts = []
+
+    parts.append(']}')
+    yield ''.join(parts).encode()
@@ -0,0 +1,206 @@
+import os
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from app import db
+
+# Receipts pivoted per chunk; also the server-side cursor fetch size
+COLUMNAR_CHUNK_SIZE = 10000
+
+# Output formats and their file extensions
+COLUMNAR_FORMATS = {
+    'parquet': 'parquet',
+    'arrow': 'arrow',
+}
+
+# Partition keys: hive-style directory name and the SQL the rows are grouped by
+PARTITION_KEYS = {
+    'user': ('user_id', 'r.user_id'),
+    'month': ('month', "to_char(r.receipt_date, 'YYYY-MM')"),
+}
+
+# OCR columns are prefixed so field types like total_amount don't clash with receipt columns
+OCR_COLUMN_PREFIX = 'ocr_'
+
+
+# pyarrow is imported only when an export runs, so the API starts without it
+def receipt_schema(ocr_columns):
+    """Arrow schema of the export: the receipt columns, then one string column per OCR field type."""
+    import pyarrow as pa
+
+    return pa.schema([
+        pa.field('receipt_id', pa.int32(), nullable=False),
+        pa.field('user_id', pa.int32(), nullable=False),
+        pa.field('batch_id', pa.int32()),
+        pa.field('upload_id', pa.int32()),
+        pa.field('receipt_date', pa.timestamp('us'), nullable=False),
+        pa.field('total_amount', pa.decimal128(10, 2), nullable=False),
+        pa.field('confidence_score', pa.float64()),
+        pa.field('is_flagged', pa.bool_()),
+        pa.field('ocr_status', pa.string()),
+        pa.field('created_at', pa.timestamp('us')),
+        pa.field('updated_at', pa.timestamp('us')),
+        pa.field('ocr_completed_at', pa.timestamp('us')),
+    ] + [pa.field(column, pa.string()) for column in ocr_columns])
+
+
+def open_columnar_writer(fmt, sink, schema):
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(sink, schema, compression='zstd')
+
+    import pyarrow as pa
+    return pa.ipc.new_file(sink, schema)
+
+
+def ocr_field_types():
+    """Every field_type seen in OCR results, in either storage mode."""
+    return db.session.execute(text("""
+        SELECT field_type FROM ocr_details
+        UNION
+        SELECT e->>'type' FROM ocr_base b, jsonb_array_elements(b.fields) e WHERE b.fields IS NOT NULL
+        ORDER BY 1
+    """)).scalars().all()
+
+
+def export_sql(partition_by=()):
+    """One row per receipt with its latest OCR result folded into a field_type -> value object.
+
+    Values are the normalized value where Document AI gave one, else the raw
+    text. A field type that occurs more than once (e.g. line items) keeps
+    its first occurrence. Rows are ordered by the partition keys, so each
+    partition is written out in one run.
+    """
+    order_by = [PARTITION_KEYS[key][1] for key in partition_by] + ['r.receipt_id']
+    if partition_by == ('user', 'month'):
+        # Same grouping, but follows ix_receipts_user_date instead of sorting
+        order_by = ['r.user_id', 'r.receipt_date', 'r.receipt_id']
+    partition_columns = ''.join(f", {PARTITION_KEYS[key][1]} AS part_{key}" for key in partition_by)
+
+    return text(f"""
+        SELECT r.receipt_id, r.user_id, r.batch_id, r.upload_id, r.receipt_date, r.total_amount,
+               r.confidence_score, r.is_flagged, r.ocr_status, r.created_at, r.updated_at,
+               r.ocr_completed_at{partition_columns},
+               COALESCE(
+                   (SELECT jsonb_object_agg(e.value->>'type', COALESCE(e.value->>'normalized_value', e.value->>'text_value')
+                                            ORDER BY e.n DESC)
+                    FROM jsonb_array_elements(b.fields) WITH ORDINALITY AS e(value, n)),
+                   (SELECT jsonb_object_agg(d.field_type, COALESCE(d.normalized_value, d.text_value)
+                                            ORDER BY d.ocr_details_id DESC)
+                    FROM ocr_details d WHERE d.ocr_base_id = b.ocr_base_id)
+               ) AS ocr_fields
+        FROM receipts r
+        LEFT JOIN LATERAL (
+            SELECT ocr_base_id, fields FROM ocr_base
+            WHERE ocr_base.receipt_id = r.receipt_id
+            ORDER BY ocr_base_id DESC LIMIT 1
+        ) b ON true
+        ORDER BY {', '.join(order_by)}
+    """)
+
+
+def partition_path(partition_by, values):
+    return os.path.join(*[f"{PARTITION_KEYS[key][0]}={value}" for key, value in zip(partition_by, values)]) \
+        if partition_by else ''
+
+
+class PartitionWriter:
+    """Writes record batches to one file per partition, holding a single file open at a time."""
+
+    def __init__(self, output_dir, fmt, schema):
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.extension = COLUMNAR_FORMATS[fmt]
+        self.schema = schema
+        self.files = []
+        self._writer = None
+        self._sink = None
+        self._partition = None
+
+    def write(self, partition, batch):
+        import pyarrow as pa
+
+        if partition != self._partition:
+            self.close()
+            directory = os.path.join(self.output_dir, partition)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-0.{self.extension}")
+            self._sink = pa.OSFile(path, 'wb')
+            self._writer = open_columnar_writer(self.fmt, self._sink, self.schema)
+            self._partition = partition
+            self.files.append(path)
+        self._writer.write_batch(batch)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+        self._writer = self._sink = self._partition = None
+
+
+def export_receipts_columnar(output_dir, fmt='parquet', partition_by=(), field_types=None,
+                             chunk_size=COLUMNAR_CHUNK_SIZE):
+    """Write every receipt with one column per OCR field type to Parquet or Arrow IPC files.
+
+    Rows come off a server-side cursor `chunk_size` at a time and each chunk
+    is pivoted and written as one record batch, so memory stays flat however
+    many receipts there are. `partition_by` is any of 'user' and 'month'
+    (receipt date); each partition gets its own hive-style directory.
+    Returns `(rows written, files written)`.
+    """
+    import pyarrow as pa
+
+    partition_by = tuple(partition_by)
+    if field_types is None:
+        field_types = ocr_field_types()
+    ocr_columns = [OCR_COLUMN_PREFIX + field_type for field_type in field_types]
+    schema = receipt_schema(ocr_columns)
+    receipt_columns = schema.names[:len(schema.names) - len(ocr_columns)]
+
+    writer = PartitionWriter(output_dir, fmt, schema)
+    written = 0
+
+    def flush(partition, rows):
+        columns = {name: [getattr(row, name) for row in rows] for name in receipt_columns}
+        for field_type, column in zip(field_types, ocr_columns):
+            columns[column] = [(row.ocr_fields or {}).get(field_type) for row in rows]
+        writer.write(partition, pa.RecordBatch.from_pydict(columns, schema=schema))
+
+    try:
+        result = db.session.execute(export_sql(partition_by).execution_options(yield_per=chunk_size))
+        # Textual results don't pick up yield_per as their partition size, so pass it explicitly
+        for chunk in result.partitions(chunk_size):
+            run, run_partition = [], None
+            for row in chunk:
+                partition = partition_path(partition_by, [getattr(row, f"part_{key}") for key in partition_by])
+                if run and partition != run_partition:
+                    flush(run_partition, run)
+                    run = []
+                run.append(row)
+                run_partition = partition
+            if run:
+                flush(run_partition, run)
+            written += len(chunk)
+            click.echo(f"Exported {written} receipts")
+    finally:
+        writer.close()
+    return written, writer.files
+
+
+@click.command('export-receipts-columnar')
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(tuple(COLUMNAR_FORMATS)), default='parquet', show_default=True)
+@click.option('--partition-by', type=click.Choice(tuple(PARTITION_KEYS)), multiple=True,
+              help='Partition files by user and/or receipt month; repeatable.')
+@click.option('--field', 'field_types', multiple=True,
+              help='OCR field types to export as columns; repeatable. Defaults to every type seen.')
+@click.option('--chunk-size', default=COLUMNAR_CHUNK_SIZE, show_default=True, help='Receipts per record batch.')
+@with_appcontext
+def export_receipts_columnar_command(output_dir, fmt, partition_by, field_types, chunk_size):
+    """Bulk-export receipts joined with their OCR fields for analytics."""
+    # Nesting follows the order the keys were given in, deduplicated
+    partition_by = tuple(dict.fromkeys(partition_by))
+    written, files = export_receipts_columnar(output_dir, fmt, partition_by, list(field_types) or None, chunk_size)
+    click.echo(f"Done: {written} receipts in {len(files)} file(s) under {output_dir}.")
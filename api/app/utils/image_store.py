@@ -0,0 +1,165 @@
+import hashlib
+import os
+import tempfile
+
+import cv2
+
+
+class ImageStore:
+    """Content-addressed store for uploaded files and receipt crops.
+
+    Blobs are named by the SHA-256 of their bytes and sharded two levels deep
+    (`3f/a2/3fa2...e1.jpg`), so no directory grows past a few thousand entries
+    and identical files are only stored once. Keys are paths relative to
+    `root`; they are what `Upload.file_path` and `Receipt.receipt_image_url`
+    hold. Flat filenames written before the store existed still resolve.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, '.tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(digest, extension):
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.{extension.lower()}"
+
+    @staticmethod
+    def digest_of(key):
+        """The content hash a key was named after, or None for legacy flat filenames."""
+        stem = os.path.splitext(os.path.basename(key))[0]
+        if len(stem) == 64 and all(c in '0123456789abcdef' for c in stem):
+            return stem
+        return None
+
+    def path(self, key):
+        """Absolute path of `key`; raises ValueError for keys outside the store."""
+        parts = key.replace('\\', '/').split('/')
+        if not key or any(part in ('', '.', '..') or part.startswith('.') for part in parts):
+            raise ValueError("Invalid image key")
+        return os.path.join(self.root, *parts)
+
+    def exists(self, key):
+        try:
+            return os.path.isfile(self.path(key))
+        except ValueError:
+            return False
+
+    def open_blob(self):
+        """Start an incremental write; see BlobWriter."""
+        return BlobWriter(self)
+
+    def put_stream(self, stream, extension):
+        """Copy a file-like object into the store, hashing it on the way.
+
+        Returns `(key, created)`; `created` is False when an identical blob
+        was already stored and the new copy was discarded.
+        """
+        writer = self.open_blob()
+        try:
+            for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                writer.write(chunk)
+        except Exception:
+            writer.discard()
+            raise
+        return writer.commit(extension)
+
+    def put_bytes(self, data, extension):
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            return self._commit(tmp_path, hashlib.sha256(data).hexdigest(), extension)
+        except Exception:
+            self._discard(tmp_path)
+            raise
+
+    def put_derived(self, key, data):
+        """Atomically write a derived blob (e.g. a thumbnail) under a caller-chosen key."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            self._discard(tmp_path)
+            raise
+        return key
+
+    def put_image(self, image, extension='jpg'):
+        """Encode a BGR array and store it; returns `(key, created)`."""
+        ok, encoded = cv2.imencode(f'.{extension}', image)
+        if not ok:
+            raise IOError(f"Could not encode image as {extension}")
+        return self.put_bytes(encoded.data, extension)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def _commit(self, tmp_path, digest, extension):
+        # Blobs are immutable, so an existing file with this name already holds these bytes
+        key = self.key_for(digest, extension)
+        path = self.path(key)
+        if os.path.exists(path):
+            self._discard(tmp_path)
+            return key, False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return key, True
+
+    @staticmethod
+    def _discard(tmp_path):
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class BlobWriter:
+    """Writes one blob chunk by chunk, hashing as it goes.
+
+    Data lands in a temp file inside the store; `commit` moves it to its
+    content-addressed key and `discard` throws it away.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp_dir)
+        self._file = os.fdopen(fd, 'wb')
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._sha256.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self, extension):
+        """Returns `(key, created)` like `ImageStore.put_bytes`."""
+        try:
+            self._file.close()
+            return self.store._commit(self.tmp_path, self._sha256.hexdigest(), extension)
+        except Exception:
+            self.discard()
+            raise
+
+    def discard(self):
+        self._file.close()
+        self.store._discard(self.tmp_path)
+
+
+_stores = {}
+
+def get_image_store(app):
+    """The image store for `app`, rooted at IMAGE_STORE_DIR or the app's uploads/receipts folder."""
+    root = app.config.get('IMAGE_STORE_DIR') or os.path.join(app.root_path, 'uploads', 'receipts')
+    store = _stores.get(root)
+    if store is None:
+        store = _stores[root] = ImageStore(root)
+    return store
@@ -0,0 +1,54 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from app import db
+
+
+def backfill_ocr_fields(batch_size=1000, delete_details=False):
+    """Copy ocr_details rows into ocr_base.fields, one committed batch of OcrBase rows at a time.
+
+    Walks ocr_base in primary-key order, so it can be stopped and re-run at
+    any point. Returns the number of OcrBase rows converted.
+    """
+    converted = 0
+    last_id = 0
+    while True:
+        ids = db.session.execute(text("""
+            SELECT ocr_base_id FROM ocr_base
+            WHERE ocr_base_id > :last_id AND fields IS NULL
+            ORDER BY ocr_base_id LIMIT :batch_size
+        """), {'last_id': last_id, 'batch_size': batch_size}).scalars().all()
+        if not ids:
+            return converted
+
+        db.session.execute(text("""
+            UPDATE ocr_base b SET fields = COALESCE((
+                SELECT jsonb_agg(jsonb_build_object(
+                    'type', d.field_type,
+                    'text_value', d.text_value,
+                    'normalized_value', d.normalized_value,
+                    'confidence', d.confidence
+                ) ORDER BY d.ocr_details_id)
+                FROM ocr_details d WHERE d.ocr_base_id = b.ocr_base_id
+            ), '[]'::jsonb)
+            WHERE b.ocr_base_id = ANY(:ids)
+        """), {'ids': ids})
+
+        if delete_details:
+            db.session.execute(text("DELETE FROM ocr_details WHERE ocr_base_id = ANY(:ids)"), {'ids': ids})
+
+        db.session.commit()
+        converted += len(ids)
+        last_id = ids[-1]
+        click.echo(f"Converted {converted} OCR results (up to ocr_base_id {last_id})")
+
+
+@click.command('backfill-ocr-fields')
+@click.option('--batch-size', default=1000, show_default=True, help='OcrBase rows per transaction.')
+@click.option('--delete-details', is_flag=True, help='Delete the migrated ocr_details rows.')
+@with_appcontext
+def backfill_ocr_fields_command(batch_size, delete_details):
+    """Move EAV OCR details into the JSONB ocr_base.fields column."""
+    converted = backfill_ocr_fields(batch_size, delete_details)
+    click.echo(f"Done: {converted} OCR results stored as JSONB.")
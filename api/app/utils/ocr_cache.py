@@ -0,0 +1,96 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db
+from app.models import OcrCache
+from app.utils.ocr_normalization import get_ocr_normalizer
+
+CACHED_FIELDS = ('ocr_results', 'avg_confidence', 'total_amount')
+
+
+class OcrResultCache:
+    """Two-tier cache of OCR results keyed by image content hash and processor version.
+
+    Lookups hit a size-bounded in-process LRU first and fall back to the
+    `ocr_cache` table, so duplicate uploads and identical crops never cost a
+    second OCR call, even across worker restarts.
+    """
+
+    def __init__(self, processor_version, max_entries=1024):
+        self.processor_version = processor_version
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(file_path):
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def get(self, content_hash):
+        with self._lock:
+            payload = self._entries.get(content_hash)
+            if payload is not None:
+                self._entries.move_to_end(content_hash)
+                return dict(payload)
+
+        entry = OcrCache.query.filter_by(
+            content_hash=content_hash,
+            processor_version=self.processor_version
+        ).first()
+        if entry is None:
+            return None
+
+        self._remember(content_hash, entry.payload)
+        return dict(entry.payload)
+
+    def put(self, content_hash, result):
+        """Store `result` in both tiers. The DB row joins the caller's transaction."""
+        payload = {field: result[field] for field in CACHED_FIELDS}
+        self._remember(content_hash, payload)
+
+        db.session.execute(
+            insert(OcrCache).values(
+                content_hash=content_hash,
+                processor_version=self.processor_version,
+                payload=payload
+            ).on_conflict_do_nothing()
+        )
+
+    def _remember(self, content_hash, payload):
+        with self._lock:
+            self._entries[content_hash] = payload
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_ocr_cache(config):
+    """Return the process-wide OCR result cache, or None when caching is disabled."""
+    global _cache
+
+    if not config.get('OCR_CACHE_ENABLED', True):
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            processor_version = ':'.join([
+                config['OCR_BACKEND'],
+                config['DOCUMENT_AI_PROCESSOR_ID'],
+                config['DOCUMENT_AI_PROCESSOR_VERSION']
+            ])
+            # Results depend on what was actually sent, so normalization settings are part of the key
+            normalizer = get_ocr_normalizer(config)
+            if normalizer is not None:
+                processor_version += ':' + normalizer.profile
+            _cache = OcrResultCache(processor_version, max_entries=config['OCR_CACHE_MAX_ENTRIES'])
+        return _cache
@@ -0,0 +1,140 @@
+import hashlib
+
+import click
+import cv2
+import numpy as np
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from app import db
+from app.models import OcrBase
+
+# JPEG qualities tried in order until the encoded image fits the byte budget
+JPEG_QUALITIES = (90, 80, 70, 60)
+
+
+class OcrImageNormalizer:
+    """Shrinks receipt images before they are sent for OCR.
+
+    Images are capped at `max_edge` pixels on their long edge, optionally
+    converted to grayscale, and re-encoded as JPEG at the highest quality in
+    JPEG_QUALITIES that fits `target_bytes`. Images already within
+    `max_edge` and under `skip_bytes` are sent untouched, as are PDFs and
+    any image the re-encode would make larger.
+
+    `sample_rate` (0..1) is the share of documents normalized; the rest form
+    the control arm of an A/B test. The arm is picked from the content hash,
+    so identical images always land in the same arm and OCR cache entries
+    stay consistent.
+    """
+
+    def __init__(self, max_edge=2400, grayscale=True, target_bytes=300_000, skip_bytes=150_000, sample_rate=1.0):
+        self.max_edge = max_edge
+        self.grayscale = grayscale
+        self.target_bytes = target_bytes
+        self.skip_bytes = skip_bytes
+        self.sample_rate = sample_rate
+
+    @property
+    def profile(self):
+        """Identifies the settings, for keying cached OCR results."""
+        return f"norm-{self.max_edge}-{'gray' if self.grayscale else 'color'}-{self.target_bytes}-{self.skip_bytes}-{self.sample_rate:g}"
+
+    def in_sample(self, content):
+        bucket = int.from_bytes(hashlib.sha256(content).digest()[:4], 'big') / 2 ** 32
+        return bucket < self.sample_rate
+
+    def normalize(self, content, mime_type):
+        """Return `(content, mime_type, stats)` for the document to send.
+
+        `stats['arm']` is 'normalized', 'skipped' (not worth re-encoding) or
+        'control' (held out by the A/B sample).
+        """
+        original_bytes = len(content)
+
+        def outcome(arm, sent=content, sent_type=mime_type):
+            return sent, sent_type, {
+                'arm': arm,
+                'source_bytes': original_bytes,
+                'sent_bytes': len(sent),
+                'bytes_saved': original_bytes - len(sent)
+            }
+
+        if not mime_type.startswith('image/'):
+            return outcome('skipped')
+        if not self.in_sample(content):
+            return outcome('control')
+
+        flags = cv2.IMREAD_GRAYSCALE if self.grayscale else cv2.IMREAD_COLOR
+        image = cv2.imdecode(np.frombuffer(content, np.uint8), flags)
+        if image is None:
+            return outcome('skipped')
+
+        height, width = image.shape[:2]
+        long_edge = max(height, width)
+        if long_edge <= self.max_edge and original_bytes <= self.skip_bytes:
+            return outcome('skipped')
+
+        if long_edge > self.max_edge:
+            scale = self.max_edge / long_edge
+            image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+        for quality in JPEG_QUALITIES:
+            ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                return outcome('skipped')
+            if encoded.nbytes <= self.target_bytes:
+                break
+
+        if encoded.nbytes >= original_bytes:
+            return outcome('skipped')
+        return outcome('normalized', encoded.tobytes(), 'image/jpeg')
+
+
+def get_ocr_normalizer(config):
+    """Build the normalizer configured by OCR_NORMALIZE_*, or None when disabled."""
+    if not config.get('OCR_NORMALIZE_ENABLED', True):
+        return None
+    return OcrImageNormalizer(
+        max_edge=config['OCR_NORMALIZE_MAX_EDGE'],
+        grayscale=config['OCR_NORMALIZE_GRAYSCALE'],
+        target_bytes=config['OCR_NORMALIZE_TARGET_BYTES'],
+        skip_bytes=config['OCR_NORMALIZE_SKIP_BYTES'],
+        sample_rate=config['OCR_NORMALIZE_SAMPLE_RATE']
+    )
+
+
+def normalization_report():
+    """Per-arm OCR call count, mean run confidence and payload sizes.
+
+    Confidence is taken from each OCR run rather than from the receipt, so a
+    receipt re-run under another arm counts once per arm.
+    """
+    return db.session.query(
+        OcrBase.normalization,
+        func.count(),
+        func.avg(OcrBase.confidence),
+        func.avg(OcrBase.source_bytes),
+        func.avg(OcrBase.sent_bytes),
+        func.sum(OcrBase.source_bytes - OcrBase.sent_bytes)
+    ).filter(OcrBase.normalization.isnot(None)) \
+     .group_by(OcrBase.normalization) \
+     .order_by(OcrBase.normalization) \
+     .all()
+
+
+@click.command('ocr-normalization-report')
+@with_appcontext
+def ocr_normalization_report_command():
+    """Compare OCR confidence and payload size between normalization arms."""
+    rows = normalization_report()
+    if not rows:
+        click.echo("No OCR calls with normalization stats yet.")
+        return
+
+    click.echo(f"{'arm':<12}{'calls':>8}{'avg conf':>10}{'avg in KB':>11}{'avg sent KB':>13}{'saved MB':>10}")
+    for arm, calls, confidence, source_bytes, sent_bytes, saved in rows:
+        click.echo(
+            f"{arm:<12}{calls:>8}{(confidence or 0):>10.4f}{(source_bytes or 0) / 1024:>11.1f}"
+            f"{(sent_bytes or 0) / 1024:>13.1f}{(saved or 0) / 1024 / 1024:>10.2f}"
+        )
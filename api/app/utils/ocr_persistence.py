@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app import db
+from app.models import OcrBase, OcrDetails
+
+
+def save_ocr_result(receipt, ocr_data, created_by=3, modified_by=3, storage_mode='eav'):
+    """Write an OCR result for `receipt` as a single unit of work.
+
+    The receipt update, the OcrBase row and every OcrDetails row go into the
+    caller's transaction; details are written with one executemany INSERT.
+    Nothing is committed here, so a crash never leaves half-written results.
+
+    With `storage_mode='jsonb'` the entities are stored as one JSONB document
+    on OcrBase.fields instead of one OcrDetails row each.
+    """
+    receipt.confidence_score = ocr_data['avg_confidence']
+    receipt.is_flagged = ocr_data['avg_confidence'] < 0.95
+    receipt.is_ocr_extracted = True
+    if ocr_data['total_amount'] is not None:
+        receipt.total_amount = ocr_data['total_amount']
+    receipt.ocr_status = 'done'
+    receipt.ocr_completed_at = datetime.utcnow()
+
+    normalization = ocr_data.get('normalization') or {}
+    ocr_base = OcrBase(
+        receipt_id=receipt.receipt_id,
+        created_by=created_by,
+        modified_by=modified_by,
+        normalization=normalization.get('arm'),
+        source_bytes=normalization.get('source_bytes'),
+        sent_bytes=normalization.get('sent_bytes'),
+        confidence=ocr_data['avg_confidence']
+    )
+    if storage_mode == 'jsonb':
+        ocr_base.fields = ocr_data['ocr_results']
+        db.session.add(ocr_base)
+        return ocr_base
+
+    db.session.add(ocr_base)
+    # Flush once to get the OcrBase id (INSERT ... RETURNING)
+    db.session.flush()
+
+    details = [{
+        'ocr_base_id': ocr_base.ocr_base_id,
+        'field_type': result['type'],
+        'text_value': result['text_value'],
+        'normalized_value': result['normalized_value'],
+        'confidence': result['confidence']
+    } for result in ocr_data['ocr_results']]
+    if details:
+        db.session.execute(insert(OcrDetails), details)
+
+    return ocr_base
+
+
+def ocr_fields(ocr_base):
+    """Entity list for `ocr_base`, whichever storage mode it was written in."""
+    if ocr_base.fields is not None:
+        return ocr_base.fields
+    return [{
+        'type': d.field_type,
+        'text_value': d.text_value,
+        'normalized_value': d.normalized_value,
+        'confidence': d.confidence
+    } for d in ocr_base.ocr_details]
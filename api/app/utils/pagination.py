@@ -0,0 +1,92 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import text, tuple_
+
+from app import db
+
+
+def encode_cursor(values):
+    """Opaque, URL-safe cursor for a row's sort-key values."""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Inverse of `encode_cursor`; raises ValueError for malformed cursors."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(payload, list) or len(payload) != len(columns):
+        raise ValueError("Invalid cursor")
+
+    values = []
+    for column, value in zip(columns, payload):
+        if value is None:
+            # Expressions such as coalesce(...) have no `nullable` and never yield NULL
+            if not getattr(column, 'nullable', False):
+                raise ValueError("Invalid cursor")
+        elif isinstance(column.type, db.DateTime):
+            try:
+                value = datetime.fromisoformat(value)
+            except (ValueError, TypeError) as e:
+                raise ValueError("Invalid cursor") from e
+        elif isinstance(column.type, db.Integer) and (not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError("Invalid cursor")
+        elif isinstance(column.type, db.Numeric) and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+            # Float is a Numeric too
+            raise ValueError("Invalid cursor")
+        values.append(value)
+    return values
+
+
+def keyset_query(query, columns, cursor=None, per_page=10, descending=True):
+    """`query` narrowed to the rows after `cursor`, ordered by `columns`, plus one lookahead row.
+
+    Raises ValueError for a malformed cursor or a `per_page` below 1.
+    """
+    if per_page < 1:
+        raise ValueError("per_page must be at least 1")
+
+    if cursor:
+        key = tuple_(*columns)
+        values = tuple_(*decode_cursor(cursor, columns))
+        query = query.filter(key < values if descending else key > values)
+
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+    return query.limit(per_page + 1)
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=10, descending=True, row_key=None):
+    """Return (items, next_cursor) for the page after `cursor`, ordered by `columns`.
+
+    `columns` must end in a unique column so every row has a distinct key.
+    Rows are located with a row-value comparison on an index matching the
+    sort order instead of OFFSET, so every page costs the same regardless of
+    depth. `next_cursor` is None on the last page.
+
+    `row_key` returns the sort-key values of a row; it is only needed when
+    `columns` contains expressions rather than plain mapped columns.
+    """
+    if row_key is None:
+        row_key = lambda row: [getattr(row, c.key) for c in columns]
+
+    items = keyset_query(query, columns, cursor, per_page, descending).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor(row_key(last))
+    return items, next_cursor
+
+
+def approximate_count(table_name):
+    """Planner row estimate for `table_name`; avoids a full COUNT(*) on large tables."""
+    estimate = db.session.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table_name"),
+        {'table_name': table_name}
+    ).scalar()
+    return max(estimate or 0, 0)
@@ -0,0 +1,236 @@
+import json
+import os
+from datetime import timedelta
+
+import click
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from app import create_app, db
+from app.config import Config
+from app.models import Receipt, OcrBase, OcrDetails
+from app.utils.change_feed import CHANGE_CLOCKS, ChangeFeedPage
+from app.utils.pagination import encode_cursor, keyset_query
+from app.utils.receipt_export import export_query
+from app.utils.receipt_queries import RECEIPT_LIST_KEY, REVIEW_QUEUE_KEY, review_queue_query
+from app.utils.receipt_queue import (
+    claimable_receipts_query, claimable_uploads_query, dead_letters_query, expired_claims_query,
+    expired_upload_claims_query
+)
+
+# Index behind each change-feed clock
+CHANGE_FEED_INDEXES = {
+    'updated': 'ix_receipts_change_feed',
+    'ocr_completed': 'ix_receipts_ocr_completed',
+}
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'migrations')
+
+# Synthetic receipts are spread over this many users, so a per-user filter is selective
+SYNTHETIC_USERS = 50
+
+
+def hot_queries(receipt, feed_receipt, ocr_base_id, user_id):
+    """The queries the API and workers run, built by their own code and paired with the index each must use.
+
+    Paged queries start from a cursor at `receipt`, so pages deep into the
+    table are checked rather than only the first one. The change feed starts
+    from `feed_receipt`, where a consumer that keeps up would be; building
+    its page runs the bound probe once. An entry naming several indexes
+    passes on any of them.
+    """
+    list_cursor = encode_cursor([getattr(receipt, column.key) for column in RECEIPT_LIST_KEY])
+    review_cursor = encode_cursor([receipt.confidence_score or 0, receipt.receipt_id])
+    feed_limit = 10000
+    lag = timedelta(seconds=current_app.config['EXPORT_CHANGE_FEED_LAG_SECONDS'])
+
+    # Both are ordered by updated_at; with near-unique timestamps the planner may take the
+    # narrower change-feed index and sort only the ties within a page
+    list_indexes = ('ix_receipts_updated_created', 'ix_receipts_change_feed')
+
+    queries = [
+        ('worker claim', 'ix_receipts_ocr_queue',
+         claimable_receipts_query().limit(1).with_for_update(skip_locked=True)),
+        ('expired receipt claims', 'ix_receipts_claim_expiry', expired_claims_query()),
+        ('segmentation claim', 'ix_uploads_queue',
+         claimable_uploads_query().limit(1).with_for_update(skip_locked=True)),
+        ('expired upload claims', 'ix_uploads_claim_expiry', expired_upload_claims_query()),
+        ('receipt list', list_indexes, keyset_query(Receipt.query, RECEIPT_LIST_KEY)),
+        ('receipt list by cursor', list_indexes,
+         keyset_query(Receipt.query, RECEIPT_LIST_KEY, cursor=list_cursor)),
+        ('review queue', 'ix_receipts_flagged',
+         keyset_query(review_queue_query(), REVIEW_QUEUE_KEY, cursor=review_cursor, per_page=50, descending=False)),
+        ('dead letters', 'ix_receipts_dead_letter', dead_letters_query().limit(10)),
+        ('export by user', 'ix_receipts_user_date', export_query(user_id=user_id)),
+        ('ocr base by receipt', 'ix_ocr_base_receipt_id',
+         OcrBase.query.filter_by(receipt_id=receipt.receipt_id)),
+        ('ocr details by base', 'ix_ocr_details_ocr_base_id',
+         OcrDetails.query.filter_by(ocr_base_id=ocr_base_id)),
+    ]
+    for clock, column in CHANGE_CLOCKS.items():
+        cursor = encode_cursor([getattr(feed_receipt, column.key), feed_receipt.receipt_id])
+        page = ChangeFeedPage(clock, cursor, feed_limit, lag)
+        queries.append((f'change feed bound ({clock})', CHANGE_FEED_INDEXES[clock], page.bound_query(feed_limit)))
+        queries.append((f'change feed page ({clock})', CHANGE_FEED_INDEXES[clock], page.query()))
+    return queries
+
+
+def load_synthetic_data(rows):
+    """Insert `rows` receipts shaped like production: mostly OCR'd, few queued, claimed, flagged or dead.
+
+    A tenth as many uploads go in alongside, mostly segmented with a few queued or claimed.
+    """
+    user_ids = db.session.execute(text("""
+        INSERT INTO users (email, password_hash)
+        SELECT 'query-plan-check-' || n || '@example.invalid', '-' FROM generate_series(1, :users) AS n
+        RETURNING user_id
+    """), {'users': SYNTHETIC_USERS}).scalars().all()
+
+    db.session.execute(text("""
+        INSERT INTO receipts (user_id, receipt_date, total_amount, confidence_score, is_flagged,
+                              ocr_status, ocr_attempts, last_ocr_attempt, claimed_until,
+                              created_at, updated_at, ocr_completed_at)
+        SELECT (:user_ids)[i % cardinality(:user_ids) + 1], now() - (i % 365) * interval '1 day', 1000,
+               random(), i % 100 = 0, s.status, 1, now() - i * interval '1 minute',
+               CASE WHEN s.status = 'processing' THEN now() - interval '1 minute' END,
+               now() - i * interval '1 minute', now() - i * interval '1 minute',
+               CASE WHEN s.status = 'done' THEN now() - i * interval '1 minute' END
+        FROM generate_series(1, :rows) AS i,
+             LATERAL (SELECT CASE WHEN i % 200 = 0 THEN 'pending'
+                                  WHEN i % 500 = 1 THEN 'failed'
+                                  WHEN i % 1000 = 2 THEN 'dead_letter'
+                                  WHEN i % 1000 = 3 THEN 'processing'
+                                  ELSE 'done' END AS status) AS s
+    """), {'user_ids': user_ids, 'rows': rows})
+
+    db.session.execute(text("""
+        INSERT INTO uploads (user_id, file_path, status, segmentation_attempts, claimed_until, created_at, updated_at)
+        SELECT (:user_ids)[i % cardinality(:user_ids) + 1], 'query-plan-check/' || i, s.status, 1,
+               CASE WHEN s.status = 'segmenting' THEN now() - interval '1 minute' END,
+               now() - i * interval '1 minute', now() - i * interval '1 minute'
+        FROM generate_series(1, :uploads) AS i,
+             LATERAL (SELECT CASE WHEN i % 100 = 0 THEN 'queued'
+                                  WHEN i % 100 = 1 THEN 'segmenting'
+                                  ELSE 'done' END AS status) AS s
+    """), {'user_ids': user_ids, 'uploads': max(rows // 10, 1)})
+
+    db.session.execute(text("""
+        INSERT INTO ocr_base (receipt_id, created_by, modified_by, created_at, modified_at)
+        SELECT receipt_id, user_id, user_id, now(), now() FROM receipts WHERE user_id = ANY(:user_ids)
+    """), {'user_ids': user_ids})
+
+    db.session.execute(text("""
+        INSERT INTO ocr_details (ocr_base_id, field_type, text_value, confidence)
+        SELECT b.ocr_base_id, f.field_type, 'value', 0.9
+        FROM ocr_base b
+        JOIN receipts r ON r.receipt_id = b.receipt_id AND r.user_id = ANY(:user_ids)
+        CROSS JOIN (VALUES ('total_amount'), ('receipt_date'), ('supplier_name')) AS f(field_type)
+    """), {'user_ids': user_ids})
+
+    db.session.execute(text("ANALYZE receipts"))
+    db.session.execute(text("ANALYZE uploads"))
+    db.session.execute(text("ANALYZE ocr_base"))
+    db.session.execute(text("ANALYZE ocr_details"))
+
+    def ocr_done_receipt(offset):
+        """The OCR'd synthetic receipt `offset` rows down from the most recently updated."""
+        return db.session.execute(text("""
+            SELECT b.receipt_id, b.ocr_base_id FROM ocr_base b
+            JOIN receipts r ON r.receipt_id = b.receipt_id
+            WHERE r.user_id = ANY(:user_ids) AND r.ocr_status = 'done'
+            ORDER BY r.updated_at DESC OFFSET :offset LIMIT 1
+        """), {'user_ids': user_ids, 'offset': offset}).one()
+
+    # Cursors land mid-table for the list and a twentieth of the way back for the change feed
+    receipt_id, ocr_base_id = ocr_done_receipt(rows // 2)
+    feed_receipt_id, _ = ocr_done_receipt(rows // 20)
+    return db.session.get(Receipt, receipt_id), db.session.get(Receipt, feed_receipt_id), ocr_base_id, user_ids[0]
+
+
+def explain(query):
+    # ORM queries wrap their statement; Core selects are one already
+    statement = getattr(query, 'statement', query).compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+    rows = db.session.connection().exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {statement}", statement.params
+    ).scalar()
+    plan = rows if isinstance(rows, list) else json.loads(rows)
+    return plan[0]['Plan']
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def check_query_plans(rows=20000):
+    """EXPLAIN every hot query against synthetic data; return a list of (name, ok, detail).
+
+    All data is written inside a transaction that is rolled back afterwards,
+    but the ANALYZE statistics and used-up sequence values stay, so only run
+    this against a scratch database, as check-query-plans does.
+    """
+    results = []
+    try:
+        receipt, feed_receipt, ocr_base_id, user_id = load_synthetic_data(rows)
+        for name, index_names, query in hot_queries(receipt, feed_receipt, ocr_base_id, user_id):
+            if isinstance(index_names, str):
+                index_names = (index_names,)
+            nodes = list(plan_nodes(explain(query)))
+            seq_scans = [n['Relation Name'] for n in nodes if n['Node Type'] == 'Seq Scan']
+            used_indexes = {n['Index Name'] for n in nodes if 'Index Name' in n}
+
+            if seq_scans:
+                results.append((name, False, f"sequential scan on {', '.join(seq_scans)}"))
+            elif not used_indexes.intersection(index_names):
+                results.append((name, False, f"expected {' or '.join(index_names)}, "
+                                             f"used {', '.join(sorted(used_indexes)) or 'no index'}"))
+            else:
+                results.append((name, True, ', '.join(sorted(used_indexes.intersection(index_names)))))
+    finally:
+        db.session.rollback()
+    return results
+
+
+def scratch_app(database_url):
+    """An app bound to `database_url` instead of the configured database."""
+    class QueryPlanCheckConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+
+    return create_app(QueryPlanCheckConfig)
+
+
+@click.command('check-query-plans')
+@click.option('--rows', default=20000, show_default=True, help='Synthetic receipts to load.')
+@with_appcontext
+def check_query_plans_command(rows):
+    """Fail if any receipts hot query stops using its index.
+
+    Runs against QUERY_PLAN_CHECK_DATABASE_URL, which must be migrated to head.
+    """
+    database_url = current_app.config['QUERY_PLAN_CHECK_DATABASE_URL']
+    if not database_url:
+        raise click.ClickException("Set QUERY_PLAN_CHECK_DATABASE_URL to a scratch database; the check runs ANALYZE "
+                                   "on synthetic data, which would skew the planner statistics of a live one.")
+    if database_url == current_app.config['SQLALCHEMY_DATABASE_URI']:
+        raise click.ClickException("QUERY_PLAN_CHECK_DATABASE_URL must not be the app's own database.")
+
+    with scratch_app(database_url).app_context():
+        try:
+            with db.engine.connect() as connection:
+                current = set(MigrationContext.configure(connection).get_current_heads())
+            if current != set(ScriptDirectory(MIGRATIONS_DIR).get_heads()):
+                raise click.ClickException("The scratch database is not at the latest migration; run "
+                                           "`flask db upgrade` with DATABASE_URL pointing at it first.")
+            results = check_query_plans(rows)
+        finally:
+            db.engine.dispose()
+
+    for name, ok, detail in results:
+        click.echo(f"{'✅' if ok else '❌'} {name}: {detail}")
+
+    if not all(ok for _, ok, _ in results):
+        raise SystemExit(1)
@@ -0,0 +1,112 @@
+import codecs
+import csv
+import io
+
+from flask import Response, stream_with_context
+from sqlalchemy import func, select
+
+from app import db
+from app.models import OcrBase, OcrDetails, Receipt
+
+# Rows fetched per round-trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 1000
+
+# Export encodings: UTF-8 with a BOM for Excel, or Shift-JIS (Windows code page 932) for Yayoi
+EXPORT_ENCODINGS = {
+    'utf-8-sig': ('utf-8-sig', 'utf-8'),
+    'shift_jis': ('cp932', 'Shift_JIS'),
+}
+
+YAYOI_HEADER = ('Date', 'Amount (JPY)', 'Vendor', 'Status')
+# Shift-JIS has no emoji, so its status labels are plain text
+STATUS_LABELS = {
+    'utf-8-sig': ('⚠️ CHECK', '✅ OK'),
+    'shift_jis': ('CHECK', 'OK'),
+}
+
+
+def latest_vendor():
+    """Vendor from the receipt's most recent OCR result, in either storage mode."""
+    jsonb_vendor = select(OcrBase.vendor) \
+        .where(OcrBase.receipt_id == Receipt.receipt_id) \
+        .order_by(OcrBase.ocr_base_id.desc()).limit(1) \
+        .scalar_subquery()
+    eav_vendor = select(OcrDetails.text_value) \
+        .join(OcrBase, OcrBase.ocr_base_id == OcrDetails.ocr_base_id) \
+        .where(OcrBase.receipt_id == Receipt.receipt_id, OcrDetails.field_type == 'supplier_name') \
+        .order_by(OcrBase.ocr_base_id.desc()).limit(1) \
+        .scalar_subquery()
+    return func.coalesce(jsonb_vendor, eav_vendor)
+
+
+def export_query(batch_id=None, user_id=None, date_from=None, date_to=None):
+    """Receipts to export, oldest receipt date first.
+
+    `date_from` is inclusive and `date_to` exclusive, both on receipt_date.
+    """
+    query = select(
+        Receipt.receipt_id,
+        Receipt.receipt_date,
+        Receipt.total_amount,
+        latest_vendor().label('vendor'),
+        Receipt.is_flagged
+    )
+    if batch_id is not None:
+        query = query.where(Receipt.batch_id == batch_id)
+    if user_id is not None:
+        query = query.where(Receipt.user_id == user_id)
+    if date_from is not None:
+        query = query.where(Receipt.receipt_date >= date_from)
+    if date_to is not None:
+        query = query.where(Receipt.receipt_date < date_to)
+    return query.order_by(Receipt.receipt_date, Receipt.receipt_id)
+
+
+def iter_rows(query, chunk_size=EXPORT_CHUNK_SIZE):
+    """Stream result rows through a server-side cursor, `chunk_size` rows at a time."""
+    result = db.session.execute(query.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        yield from partition
+
+
+def iter_yayoi_csv(rows, encoding='utf-8-sig', chunk_size=EXPORT_CHUNK_SIZE):
+    """Encode export rows as Yayoi CSV, yielding one encoded chunk per `chunk_size` rows.
+
+    Quoting and escaping are left to the csv module; characters the target
+    encoding cannot represent are replaced rather than failing the export.
+    """
+    codec, _ = EXPORT_ENCODINGS[encoding]
+    encoder = codecs.getincrementalencoder(codec)(errors='replace')
+    flagged_label, ok_label = STATUS_LABELS[encoding]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\r\n')
+    writer.writerow(YAYOI_HEADER)
+
+    def flush():
+        data = encoder.encode(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow((
+            row.receipt_date.strftime("%Y/%m/%d") if row.receipt_date else '',
+            row.total_amount if row.total_amount is not None else '',
+            row.vendor or '',
+            flagged_label if row.is_flagged else ok_label
+        ))
+        if count % chunk_size == 0:
+            yield flush()
+
+    yield flush() + encoder.encode('', final=True)
+
+
+def yayoi_csv_response(query, filename, encoding='utf-8-sig'):
+    """Stream `query` as a Yayoi CSV download without holding the result in memory."""
+    _, charset = EXPORT_ENCODINGS[encoding]
+    return Response(
+        stream_with_context(iter_yayoi_csv(iter_rows(query), encoding)),
+        content_type=f'text/csv; charset={charset}',
+        headers={"Content-disposition": f"attachment; filename={filename}"}
+    )
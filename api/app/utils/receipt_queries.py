@@ -0,0 +1,27 @@
+from sqlalchemy import func
+
+from app.models import Receipt
+
+# Sort keys of the receipt list (ix_receipts_updated_created) and the review queue (ix_receipts_flagged)
+RECEIPT_LIST_KEY = [Receipt.updated_at, Receipt.created_at, Receipt.receipt_id]
+REVIEW_QUEUE_KEY = [func.coalesce(Receipt.confidence_score, 0), Receipt.receipt_id]
+
+
+def review_queue_query(min_confidence=None, max_confidence=None, user_id=None, batch_id=None,
+                       date_from=None, date_to=None):
+    """Flagged receipts matching the review-queue filters; `date_from`/`date_to` are on created_at."""
+    confidence = REVIEW_QUEUE_KEY[0]
+    query = Receipt.query.filter_by(is_flagged=True)
+    if min_confidence is not None:
+        query = query.filter(confidence >= min_confidence)
+    if max_confidence is not None:
+        query = query.filter(confidence <= max_confidence)
+    if user_id is not None:
+        query = query.filter(Receipt.user_id == user_id)
+    if batch_id is not None:
+        query = query.filter(Receipt.batch_id == batch_id)
+    if date_from is not None:
+        query = query.filter(Receipt.created_at >= date_from)
+    if date_to is not None:
+        query = query.filter(Receipt.created_at < date_to)
+    return query
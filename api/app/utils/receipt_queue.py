@@ -0,0 +1,267 @@
+import random
+import select
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, or_, text
+
+from app import db
+from app.models import Receipt, Upload
+
+CLAIMABLE_STATUSES = ('pending', 'failed')
+DEAD_LETTER_STATUS = 'dead_letter'
+QUEUE_CHANNEL = 'receipts_queued'
+UPLOAD_QUEUE_CHANNEL = 'uploads_queued'
+
+
+def claimable_receipts_query():
+    """Receipts due for an OCR attempt, oldest first (served by ix_receipts_ocr_queue)."""
+    return Receipt.query.filter(
+        Receipt.ocr_status.in_(CLAIMABLE_STATUSES),
+        or_(Receipt.next_attempt_at.is_(None), Receipt.next_attempt_at <= datetime.utcnow())
+    ).order_by(Receipt.created_at)
+
+
+def expired_claims_query():
+    """'processing' receipts whose claim lease has run out (served by ix_receipts_claim_expiry)."""
+    return Receipt.query.filter(
+        Receipt.ocr_status == 'processing',
+        Receipt.claimed_until < datetime.utcnow()
+    )
+
+
+def release_expired_claims(max_attempts):
+    """Put receipts claimed by a worker that died mid-batch back in the queue.
+
+    They become due 'failed' receipts, or dead letters once their attempts
+    are used up, so a receipt that keeps killing its worker cannot loop
+    forever. The caller commits.
+    """
+    message = "Claim expired: the worker stopped before finishing"
+    dead_lettered = expired_claims_query().filter(Receipt.ocr_attempts >= max_attempts).update({
+        Receipt.ocr_status: DEAD_LETTER_STATUS,
+        Receipt.next_attempt_at: None,
+        Receipt.ocr_error_message: message
+    }, synchronize_session=False)
+    retried = expired_claims_query().update({
+        Receipt.ocr_status: 'failed',
+        Receipt.next_attempt_at: None,
+        Receipt.ocr_error_message: message
+    }, synchronize_session=False)
+    return dead_lettered + retried
+
+
+def claim_receipts(batch_size=1, lease_seconds=900, max_attempts=3):
+    """Atomically claim up to `batch_size` queued receipts for this worker.
+
+    Rows are locked with FOR UPDATE SKIP LOCKED, so concurrent workers never
+    pick up the same receipt; rows already locked by another worker are skipped
+    instead of waited on. Each claim is a lease of `lease_seconds`: if the
+    worker is killed before finishing, the receipt is released by the next
+    claim made after the lease has run out.
+    """
+    released = release_expired_claims(max_attempts)
+    if released:
+        print(f"♻️ Released {released} receipts whose claim expired.")
+
+    receipts = claimable_receipts_query().limit(batch_size).with_for_update(skip_locked=True).all()
+
+    now = datetime.now(timezone.utc)
+    claimed_until = datetime.utcnow() + timedelta(seconds=lease_seconds)
+    for receipt in receipts:
+        receipt.ocr_status = 'processing'
+        receipt.ocr_attempts = (receipt.ocr_attempts or 0) + 1
+        receipt.last_ocr_attempt = now
+        receipt.next_attempt_at = None
+        receipt.claimed_until = claimed_until
+
+    # Committing releases the row locks; the 'processing' status now keeps
+    # other workers away from these receipts until the lease expires.
+    db.session.commit()
+    return receipts
+
+
+
+def retry_delay(attempts, base_delay, max_delay):
+    """Capped exponential backoff with jitter, in seconds, after `attempts` failed attempts."""
+    delay = min(max_delay, base_delay * 2 ** max(attempts - 1, 0))
+    return random.uniform(delay / 2, delay)
+
+
+def schedule_retry(receipt, error, max_attempts, base_delay, max_delay):
+    """Record a failed OCR attempt and either schedule a retry or dead-letter the receipt."""
+    receipt.ocr_error_message = str(error)
+
+    if receipt.ocr_attempts >= max_attempts:
+        receipt.ocr_status = DEAD_LETTER_STATUS
+        receipt.next_attempt_at = None
+        return None
+
+    delay = retry_delay(receipt.ocr_attempts, base_delay, max_delay)
+    receipt.ocr_status = 'failed'
+    receipt.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    return delay
+
+
+def seconds_until_next_retry(default):
+    """Seconds until the earliest scheduled retry is due, capped at `default`.
+
+    Ends the transaction the lookup opened, since the caller goes on to wait
+    for that long and must not sit idle in transaction holding a lock on receipts.
+    """
+    next_attempt_at = db.session.query(func.min(Receipt.next_attempt_at)).filter(
+        Receipt.ocr_status == 'failed'
+    ).scalar()
+    db.session.commit()
+    if next_attempt_at is None:
+        return default
+    return max(0, min(default, (next_attempt_at - datetime.utcnow()).total_seconds()))
+
+
+def dead_letters_query():
+    """Dead-lettered receipts, most recent attempt first (served by ix_receipts_dead_letter)."""
+    return Receipt.query.filter(Receipt.ocr_status == DEAD_LETTER_STATUS).order_by(Receipt.last_ocr_attempt.desc())
+
+
+def requeue_dead_letters(receipt_ids=None):
+    """Move dead-lettered receipts back to 'pending' with a fresh attempt budget.
+
+    Requeues every dead-lettered receipt when `receipt_ids` is None. The caller commits.
+    """
+    query = Receipt.query.filter(Receipt.ocr_status == DEAD_LETTER_STATUS)
+    if receipt_ids is not None:
+        query = query.filter(Receipt.receipt_id.in_(receipt_ids))
+
+    count = query.update({
+        Receipt.ocr_status: 'pending',
+        Receipt.ocr_attempts: 0,
+        Receipt.next_attempt_at: None,
+        Receipt.ocr_error_message: None
+    }, synchronize_session=False)
+
+    if count:
+        notify_receipts_queued()
+    return count
+
+def claimable_uploads_query():
+    """Uploads waiting for segmentation, oldest first (served by ix_uploads_queue)."""
+    return Upload.query.filter(Upload.status == 'queued').order_by(Upload.created_at)
+
+
+def expired_upload_claims_query():
+    """'segmenting' uploads whose claim lease has run out (served by ix_uploads_claim_expiry)."""
+    return Upload.query.filter(
+        Upload.status == 'segmenting',
+        Upload.claimed_until < datetime.utcnow()
+    )
+
+
+def release_expired_upload_claims(max_attempts):
+    """Requeue uploads claimed by a segmentation worker that died, failing those out of attempts.
+
+    The caller commits.
+    """
+    failed = expired_upload_claims_query().filter(Upload.segmentation_attempts >= max_attempts).update({
+        Upload.status: 'failed',
+        Upload.error_message: f"Segmentation did not finish after {max_attempts} attempts"
+    }, synchronize_session=False)
+    requeued = expired_upload_claims_query().update({Upload.status: 'queued'}, synchronize_session=False)
+    return failed + requeued
+
+
+def claim_uploads(batch_size=1, lease_seconds=1800, max_attempts=3):
+    """Atomically claim up to `batch_size` queued uploads for segmentation (FOR UPDATE SKIP LOCKED).
+
+    Like `claim_receipts`, each claim is a lease: uploads left 'segmenting'
+    by a worker that died are requeued once it has run out.
+    """
+    released = release_expired_upload_claims(max_attempts)
+    if released:
+        print(f"♻️ Released {released} uploads whose claim expired.")
+
+    uploads = claimable_uploads_query().limit(batch_size).with_for_update(skip_locked=True).all()
+
+    claimed_until = datetime.utcnow() + timedelta(seconds=lease_seconds)
+    for upload in uploads:
+        upload.status = 'segmenting'
+        upload.segmentation_attempts = (upload.segmentation_attempts or 0) + 1
+        upload.claimed_until = claimed_until
+
+    db.session.commit()
+    return uploads
+
+
+def notify_receipts_queued():
+    """Wake idle OCR workers. Postgres delivers the notification when the current transaction commits."""
+    db.session.execute(text(f"NOTIFY {QUEUE_CHANNEL}"))
+
+
+def notify_uploads_queued():
+    """Wake idle segmentation workers once the current transaction commits."""
+    db.session.execute(text(f"NOTIFY {UPLOAD_QUEUE_CHANNEL}"))
+
+
+class QueueListener:
+    """Blocks until work is queued on `channel`, using LISTEN on a dedicated connection.
+
+    LISTEN is issued as soon as the listener is created, and again right
+    after a reconnect, so the caller always checks the queue after listening
+    and a notification sent in between cannot be missed.
+    """
+
+    def __init__(self, engine, channel=QUEUE_CHANNEL):
+        self.engine = engine
+        self.channel = channel
+        self.connection = None
+        self.listen()
+
+    def listen(self):
+        """LISTEN on a fresh connection; returns False if the database can't be reached."""
+        self.close()
+        try:
+            raw = self.engine.raw_connection()
+            connection = raw.driver_connection
+            # Keep this connection out of the pool: it stays in autocommit mode for its whole life
+            raw.detach()
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+        except Exception as e:
+            print(f"⚠️ Could not listen on {self.channel}: {e}")
+            return False
+        self.connection = connection
+        return True
+
+    def wait(self, timeout):
+        """Return True when woken by a notification, False on timeout or connection loss.
+
+        After a connection loss it returns as soon as LISTEN is re-issued, so
+        the caller re-checks the queue for work queued while it was deaf.
+        """
+        if self.connection is None:
+            self._reconnect(timeout)
+            return False
+        try:
+            readable, _, _ = select.select([self.connection], [], [], timeout)
+            if not readable:
+                return False
+            self.connection.poll()
+            self.connection.notifies.clear()
+            return True
+        except Exception as e:
+            print(f"⚠️ Lost queue listener connection: {e}")
+            self._reconnect(timeout)
+            return False
+
+    def _reconnect(self, timeout):
+        if not self.listen():
+            # Fall back to a short sleep so a broken listener can't turn into a hot loop
+            time.sleep(min(timeout, 5))
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
@@ -0,0 +1,126 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from app.utils.segmentation_utils import crop_boxes, segment_receipt_boxes
+
+
+def _segment_shared_page(shm_name, shape, dtype):
+    """Pool task: attach to a page in shared memory and return its receipt boxes.
+
+    Only the segment name goes in and a short list of boxes comes back, so no
+    pixel data is pickled in either direction.
+    """
+    # Spawned children share the parent's resource tracker, so attaching here
+    # does not hand ownership of the segment to this process
+    shm = SharedMemory(name=shm_name)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        boxes = segment_receipt_boxes(image)
+        del image
+        return boxes
+    finally:
+        shm.close()
+
+
+class _SharedPage:
+    """A page copied into a shared memory segment owned by this process."""
+
+    def __init__(self, image):
+        self.shm = SharedMemory(create=True, size=max(image.nbytes, 1))
+        self.image = np.ndarray(image.shape, dtype=image.dtype, buffer=self.shm.buf)
+        self.image[...] = image
+
+    def release(self):
+        self.image = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SegmentationExecutor:
+    """Segments pages across a pool of processes.
+
+    `segment(pages)` takes an iterable of `(tag, image)` pairs - typically pages
+    from several uploads, tagged with the upload they came from - and yields
+    `(tag, crops, error)` for each page in input order. Pages are handed to
+    the pool through shared memory and only bounding boxes come back; crops
+    are views into the page, valid until the next item is requested.
+
+    At most `max_in_flight` pages (two per process by default) are held at
+    once, so rasterizing a long PDF stays bounded in memory. With
+    `processes <= 1` pages are segmented in this process and no pool is started.
+
+    If a pool process dies (e.g. OOM-killed), the pages in flight fail with
+    BrokenProcessPool and the pool is replaced before the next page is sent.
+    """
+
+    def __init__(self, processes=None, max_in_flight=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_in_flight = max_in_flight or 2 * self.processes
+        self.pool = None
+        if self.processes > 1:
+            self._start_pool()
+
+    def _start_pool(self):
+        # Spawned children don't inherit the worker's DB connections or gRPC channels
+        self.pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+
+    def _submit(self, page):
+        args = (_segment_shared_page, page.shm.name, page.image.shape, page.image.dtype.str)
+        try:
+            return self.pool.submit(*args)
+        except BrokenProcessPool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self._start_pool()
+            return self.pool.submit(*args)
+
+    def segment(self, pages):
+        if self.pool is None:
+            for tag, image in pages:
+                try:
+                    yield tag, crop_boxes(image, segment_receipt_boxes(image)), None
+                except Exception as e:
+                    yield tag, [], e
+            return
+
+        in_flight = deque()
+        try:
+            for tag, image in pages:
+                page = _SharedPage(image)
+                del image
+                try:
+                    future = self._submit(page)
+                except Exception:
+                    page.release()
+                    raise
+                in_flight.append((tag, page, future))
+
+                if len(in_flight) >= self.max_in_flight:
+                    yield from self._drain_oldest(in_flight)
+
+            while in_flight:
+                yield from self._drain_oldest(in_flight)
+        finally:
+            for _, page, future in in_flight:
+                future.cancel()
+                page.release()
+
+    def _drain_oldest(self, in_flight):
+        tag, page, future = in_flight[0]
+        try:
+            boxes, error = future.result(), None
+        except Exception as e:
+            boxes, error = [], e
+        try:
+            yield tag, crop_boxes(page.image, boxes), error
+        finally:
+            in_flight.popleft()
+            page.release()
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
@@ -0,0 +1,148 @@
+import math
+
+import cv2
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+
+# Contours are searched on a proxy image no larger than this along its long edge
+DETECTION_MAX_EDGE = 1000
+# Smallest receipt, as a share of the page area (about 50000 px on a 200-DPI letter page)
+MIN_RECEIPT_AREA_RATIO = 0.013
+
+# Blank-crop statistics are measured on a grayscale proxy no larger than this
+BLANK_CHECK_MAX_EDGE = 256
+# A pixel counts as ink when it is this much darker than the crop's median (paper) level
+INK_CONTRAST = 40
+
+def detect_receipt_boxes(image, max_edge=DETECTION_MAX_EDGE, min_area_ratio=MIN_RECEIPT_AREA_RATIO):
+    """Find rectangular receipts in `image` and return their full-resolution
+    bounding boxes as `(x0, y0, x1, y1)` tuples.
+
+    Edge and contour detection run on a grayscale proxy downscaled to
+    `max_edge` pixels; bounding boxes are mapped back to the original image.
+    `max_edge=None` detects at full resolution.
+    """
+    height, width = image.shape[:2]
+
+    # Downscale before anything else so no full-resolution intermediate is allocated.
+    # Bilinear decimation keeps the large paper-vs-background edges we look for;
+    # an integer factor keeps the mapping back to full resolution exact.
+    factor = 1
+    proxy = image
+    if max_edge and max(height, width) > max_edge:
+        factor = math.ceil(max(height, width) / max_edge)
+        proxy = cv2.resize(image, (width // factor, height // factor), interpolation=cv2.INTER_LINEAR)
+
+    gray = cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    edged = cv2.Canny(blurred, 50, 200)
+    contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:10]
+
+    boxes = []
+    min_area = min_area_ratio * gray.shape[0] * gray.shape[1]
+
+    for contour in contours:
+        peri = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
+        if len(approx) == 4 and cv2.contourArea(contour) > min_area:
+            x, y, w, h = cv2.boundingRect(contour)
+            aspect_ratio = w / float(h)
+            if 0.2 <= aspect_ratio <= 5:
+                # Map the proxy bounding box back to full resolution
+                x0, y0 = x * factor, y * factor
+                x1, y1 = min(width, (x + w) * factor), min(height, (y + h) * factor)
+                boxes.append((x0, y0, x1, y1))
+
+    return boxes
+
+def detect_receipt_contours(image, max_edge=DETECTION_MAX_EDGE, min_area_ratio=MIN_RECEIPT_AREA_RATIO):
+    """Find rectangular receipts in `image` and return full-resolution crops."""
+    return crop_boxes(image, detect_receipt_boxes(image, max_edge=max_edge, min_area_ratio=min_area_ratio))
+
+def crop_boxes(image, boxes):
+    return [image[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes]
+
+def segment_receipt_boxes(image):
+    """Bounding boxes of the receipts on a page, falling back to a 2x3 grid."""
+    return detect_receipt_boxes(image) or grid_segment_boxes(image.shape, rows=2, cols=3)
+
+def segment_receipts(image):
+    return crop_boxes(image, segment_receipt_boxes(image))
+
+def grid_segment_boxes(shape, rows, cols):
+    height, width = shape[:2]
+    cell_height = height // rows
+    cell_width = width // cols
+
+    return [
+        (j * cell_width, i * cell_height, (j + 1) * cell_width, (i + 1) * cell_height)
+        for i in range(rows) for j in range(cols)
+    ]
+
+def grid_segment_receipts(image, rows, cols):
+    return crop_boxes(image, grid_segment_boxes(image.shape, rows, cols))
+
+def crop_content_stats(crop, max_edge=BLANK_CHECK_MAX_EDGE):
+    """Measure how much is printed on `crop`.
+
+    Returns the grayscale standard deviation, the share of pixels darker than
+    the paper ("ink") and the share of Canny edge pixels, all taken from a
+    small proxy so the check costs well under a millisecond per crop.
+    """
+    height, width = crop.shape[:2]
+    factor = max(1, math.ceil(max(height, width) / max_edge))
+    proxy = crop if factor == 1 else cv2.resize(crop, (max(1, width // factor), max(1, height // factor)), interpolation=cv2.INTER_LINEAR)
+    gray = cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY) if proxy.ndim == 3 else proxy
+
+    paper = np.median(gray)
+    return {
+        'stddev': float(gray.std()),
+        'ink_ratio': np.count_nonzero(gray < paper - INK_CONTRAST) / gray.size,
+        'edge_ratio': np.count_nonzero(cv2.Canny(gray, 50, 150)) / gray.size,
+    }
+
+def is_blank_crop(crop, min_stddev, min_ink_ratio, min_edge_ratio):
+    """True when `crop` is empty paper or background not worth sending to OCR.
+
+    A crop is blank when it is flat (low variance), or when it has neither
+    enough ink nor enough edges to hold any text.
+    """
+    if crop.size == 0:
+        return True
+    stats = crop_content_stats(crop)
+    if stats['stddev'] < min_stddev:
+        return True
+    return stats['ink_ratio'] < min_ink_ratio and stats['edge_ratio'] < min_edge_ratio
+
+def iter_pdf_pages(pdf_path, dpi=200):
+    """Rasterize a PDF one page at a time, yielding each page as a BGR array.
+
+    Only the current page is held in memory, and pages go straight from
+    poppler's PIL buffer to NumPy with no temporary image files.
+    """
+    page_count = pdfinfo_from_path(pdf_path)['Pages']
+    for page_number in range(1, page_count + 1):
+        page = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)[0]
+        yield cv2.cvtColor(np.asarray(page.convert('RGB')), cv2.COLOR_RGB2BGR)
+        page.close()
+
+def iter_upload_pages(file_path, file_extension, dpi=200):
+    """Yield the pages of an uploaded image or PDF as BGR arrays."""
+    if file_extension in ['png', 'jpg', 'jpeg']:
+        image = cv2.imread(file_path)
+        if image is None:
+            raise ValueError("Could not read image file")
+        yield image
+    elif file_extension == 'pdf':
+        yield from iter_pdf_pages(file_path, dpi=dpi)
+
+def extract_receipt_images(file_path, file_extension, dpi=200):
+    """Segment an uploaded image or PDF into individual receipt crops.
+
+    Crops are yielded as they are found so callers can write them out before
+    the next PDF page is rasterized.
+    """
+    for image in iter_upload_pages(file_path, file_extension, dpi=dpi):
+        yield from segment_receipts(image)
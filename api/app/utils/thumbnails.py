@@ -0,0 +1,57 @@
+import os
+
+import cv2
+
+# Long-edge sizes (px) thumbnails are generated at; requests are rounded up to the next bucket
+THUMBNAIL_SIZES = (160, 320, 640)
+
+ENCODE_PARAMS = {
+    'webp': [cv2.IMWRITE_WEBP_QUALITY, 75],
+    'jpg': [cv2.IMWRITE_JPEG_QUALITY, 70],
+}
+
+def thumbnail_bucket(size, sizes=THUMBNAIL_SIZES):
+    """Smallest configured bucket at least `size` pixels wide, capped at the largest."""
+    return next((bucket for bucket in sorted(sizes) if bucket >= size), max(sizes))
+
+def thumbnail_key(image_key, size, fmt='webp'):
+    stem = os.path.splitext(image_key)[0]
+    return f"thumbs/{size}/{stem}.{fmt}"
+
+def make_thumbnail(image, size, fmt='webp'):
+    """Encode `image` scaled down so its long edge is at most `size` pixels."""
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+    ok, encoded = cv2.imencode(f'.{fmt}', image, ENCODE_PARAMS.get(fmt, []))
+    if not ok:
+        raise IOError(f"Could not encode thumbnail as {fmt}")
+    return encoded.tobytes()
+
+def store_thumbnails(store, image_key, image, sizes=THUMBNAIL_SIZES, fmt='webp'):
+    """Write every thumbnail bucket for an image that is already decoded in memory."""
+    for size in sizes:
+        store.put_derived(thumbnail_key(image_key, size, fmt), make_thumbnail(image, size, fmt))
+
+def delete_thumbnails(store, image_key, fmt='webp', sizes=THUMBNAIL_SIZES):
+    for size in sizes:
+        store.delete(thumbnail_key(image_key, size, fmt))
+
+def ensure_thumbnail(store, image_key, size, fmt='webp'):
+    """Return the path of the `size` thumbnail of `image_key`, generating it on first request.
+
+    Raises FileNotFoundError if the source image does not exist.
+    """
+    key = thumbnail_key(image_key, size, fmt)
+    path = store.path(key)
+    if os.path.exists(path):
+        return path
+
+    source = store.path(image_key)
+    image = cv2.imread(source) if os.path.exists(source) else None
+    if image is None:
+        raise FileNotFoundError(image_key)
+    store.put_derived(key, make_thumbnail(image, size, fmt))
+    return path
@@ -0,0 +1,70 @@
+"""Compare receipt contour detection at full resolution and on a downscaled proxy.
+
+Usage:
+    python benchmark_segmentation.py                 # synthetic scans at common flatbed sizes
+    python benchmark_segmentation.py scan1.jpg ...   # your own scans
+"""
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from app.utils.segmentation_utils import detect_receipt_contours, DETECTION_MAX_EDGE
+
+# (label, width, height) of an A4 page scanned at common flatbed resolutions
+SCAN_SIZES = [
+    ('A4 @ 200 DPI', 1654, 2339),
+    ('A4 @ 300 DPI', 2480, 3508),
+    ('A4 @ 600 DPI', 4961, 7016),
+]
+
+def synthetic_scan(width, height, receipts=3):
+    """A light page with a few dark-bordered, text-covered receipt rectangles."""
+    rng = np.random.default_rng(0)
+    image = np.full((height, width, 3), 235, np.uint8)
+    image += rng.integers(0, 12, image.shape, dtype=np.uint8)
+    column_width = width // receipts
+    for i in range(receipts):
+        x0, y0 = i * column_width + column_width // 10, height // 10
+        x1, y1 = (i + 1) * column_width - column_width // 10, height - height // 6
+        cv2.rectangle(image, (x0, y0), (x1, y1), (255, 255, 255), -1)
+        cv2.rectangle(image, (x0, y0), (x1, y1), (40, 40, 40), max(2, width // 500))
+        for line_y in range(y0 + height // 40, y1 - height // 40, height // 60):
+            cv2.line(image, (x0 + column_width // 20, line_y), (x1 - column_width // 4, line_y), (60, 60, 60), max(1, width // 1000))
+    return image
+
+def measure(image, max_edge, repeat=3):
+    """Best-of-`repeat` latency in ms, peak traced allocation in MB and receipts found."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        receipts = detect_receipt_contours(image, max_edge=max_edge)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    detect_receipt_contours(image, max_edge=max_edge)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak / 2**20, len(receipts)
+
+def main(paths):
+    if paths:
+        scans = [(path, cv2.imread(path)) for path in paths]
+    else:
+        scans = [(label, synthetic_scan(width, height)) for label, width, height in SCAN_SIZES]
+
+    print(f"{'scan':<22}{'pixels':>10}  {'full-res ms':>12}{'MB':>8}{'found':>7}  {'proxy ms':>10}{'MB':>8}{'found':>7}  {'speedup':>8}")
+    for label, image in scans:
+        if image is None:
+            print(f"{label:<22} could not be read")
+            continue
+        full_ms, full_mb, full_found = measure(image, max_edge=None)
+        proxy_ms, proxy_mb, proxy_found = measure(image, max_edge=DETECTION_MAX_EDGE)
+        megapixels = image.shape[0] * image.shape[1] / 1e6
+        print(f"{label:<22}{megapixels:>9.1f}M  {full_ms:>12.1f}{full_mb:>8.1f}{full_found:>7}  "
+              f"{proxy_ms:>10.1f}{proxy_mb:>8.1f}{proxy_found:>7}  {full_ms / proxy_ms:>7.1f}x")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,31 @@
+"""review queue index
+
+Revision ID: 5a9b3e7c1d20
+Revises: c81f5d0e6a37
+Create Date: 2025-05-13 09:52:16.384410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a9b3e7c1d20'
+down_revision = 'c81f5d0e6a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Receipts flagged before OCR have no confidence score; sort them as 0 so they lead the queue
+    with op.batch_alter_table('receipts', schema=None) as batch_op:
+        batch_op.drop_index('ix_receipts_flagged')
+        batch_op.create_index('ix_receipts_flagged', [sa.text('COALESCE(confidence_score, 0)'), 'receipt_id'],
+                              unique=False, postgresql_where=sa.text('is_flagged'))
+
+
+def downgrade():
+    with op.batch_alter_table('receipts', schema=None) as batch_op:
+        batch_op.drop_index('ix_receipts_flagged')
+        batch_op.create_index('ix_receipts_flagged', ['confidence_score', 'receipt_id'], unique=False,
+                              postgresql_where=sa.text('is_flagged'))
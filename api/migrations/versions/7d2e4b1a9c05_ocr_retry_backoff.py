@@ -0,0 +1,31 @@
+"""ocr retry backoff and dead letter
+
+Revision ID: 7d2e4b1a9c05
+Revises: 3f1c7a9e2b44
+Create Date: 2025-05-06 16:41:09.207733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e4b1a9c05'
+down_revision = '3f1c7a9e2b44'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('receipts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+
+    # 'failed_permanently' receipts become terminal dead letters
+    op.execute("UPDATE receipts SET ocr_status = 'dead_letter' WHERE ocr_status = 'failed_permanently'")
+
+
+def downgrade():
+    op.execute("UPDATE receipts SET ocr_status = 'failed_permanently' WHERE ocr_status = 'dead_letter'")
+
+    with op.batch_alter_table('receipts', schema=None) as batch_op:
+        batch_op.drop_column('next_attempt_at')
@@ -0,0 +1,49 @@
+"""receipts hot query indexes
+
+Revision ID: c81f5d0e6a37
+Revises: 7d2e4b1a9c05
+Create Date: 2025-05-09 11:27:52.618904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81f5d0e6a37'
+down_revision = '7d2e4b1a9c05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('receipts', schema=None) as batch_op:
+        batch_op.create_index('ix_receipts_ocr_queue', ['created_at'], unique=False,
+                              postgresql_where=sa.text("ocr_status IN ('pending', 'failed')"))
+        batch_op.create_index('ix_receipts_updated_created',
+                              [sa.text('updated_at DESC'), sa.text('created_at DESC'), sa.text('receipt_id DESC')],
+                              unique=False)
+        batch_op.create_index('ix_receipts_flagged', ['confidence_score', 'receipt_id'], unique=False,
+                              postgresql_where=sa.text('is_flagged'))
+        batch_op.create_index('ix_receipts_dead_letter', ['last_ocr_attempt'], unique=False,
+                              postgresql_where=sa.text("ocr_status = 'dead_letter'"))
+
+    with op.batch_alter_table('ocr_base', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ocr_base_receipt_id'), ['receipt_id'], unique=False)
+
+    with op.batch_alter_table('ocr_details', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ocr_details_ocr_base_id'), ['ocr_base_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ocr_details', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ocr_details_ocr_base_id'))
+
+    with op.batch_alter_table('ocr_base', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ocr_base_receipt_id'))
+
+    with op.batch_alter_table('receipts', schema=None) as batch_op:
+        batch_op.drop_index('ix_receipts_dead_letter')
+        batch_op.drop_index('ix_receipts_flagged')
+        batch_op.drop_index('ix_receipts_updated_created')
+        batch_op.drop_index('ix_receipts_ocr_queue')
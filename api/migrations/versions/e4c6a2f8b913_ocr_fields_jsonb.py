@@ -0,0 +1,43 @@
+"""ocr fields jsonb
+
+Revision ID: e4c6a2f8b913
+Revises: 5a9b3e7c1d20
+Create Date: 2025-05-20 14:08:33.771052
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'e4c6a2f8b913'
+down_revision = '5a9b3e7c1d20'
+branch_labels = None
+depends_on = None
+
+TOTAL_AMOUNT_SQL = r"""(jsonb_path_query_first(fields, '$[*] ? (@.type == "total_amount" && @.normalized_value like_regex "^-?[0-9]+(\\.[0-9]+)?$").normalized_value') #>> '{}')::numeric(12, 2)"""
+RECEIPT_DATE_SQL = """jsonb_path_query_first(fields, '$[*] ? (@.type == "receipt_date").normalized_value') #>> '{}'"""
+VENDOR_SQL = """jsonb_path_query_first(fields, '$[*] ? (@.type == "supplier_name").text_value') #>> '{}'"""
+
+
+def upgrade():
+    # Existing rows are moved over with `flask backfill-ocr-fields`
+    with op.batch_alter_table('ocr_base', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fields', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+        batch_op.add_column(sa.Column('total_amount', sa.Numeric(precision=12, scale=2), sa.Computed(TOTAL_AMOUNT_SQL, persisted=True), nullable=True))
+        batch_op.add_column(sa.Column('receipt_date', sa.String(), sa.Computed(RECEIPT_DATE_SQL, persisted=True), nullable=True))
+        batch_op.add_column(sa.Column('vendor', sa.String(), sa.Computed(VENDOR_SQL, persisted=True), nullable=True))
+        batch_op.create_index(batch_op.f('ix_ocr_base_total_amount'), ['total_amount'], unique=False)
+        batch_op.create_index(batch_op.f('ix_ocr_base_receipt_date'), ['receipt_date'], unique=False)
+        batch_op.create_index(batch_op.f('ix_ocr_base_vendor'), ['vendor'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ocr_base', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ocr_base_vendor'))
+        batch_op.drop_index(batch_op.f('ix_ocr_base_receipt_date'))
+        batch_op.drop_index(batch_op.f('ix_ocr_base_total_amount'))
+        batch_op.drop_column('vendor')
+        batch_op.drop_column('receipt_date')
+        batch_op.drop_column('total_amount')
+        batch_op.drop_column('fields')
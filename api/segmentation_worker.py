@@ -0,0 +1,236 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.models import Receipt
+from app.utils.image_store import get_image_store
+from app.utils.receipt_queue import (claim_uploads, notify_receipts_queued, notify_uploads_queued,
+                                     QueueListener, UPLOAD_QUEUE_CHANNEL)
+from app.utils.segmentation_pool import SegmentationExecutor
+from app.utils.segmentation_utils import is_blank_crop, iter_upload_pages
+from app.utils.thumbnails import delete_thumbnails, store_thumbnails
+
+app = create_app()
+
+# Blank crops dropped since the worker started, i.e. Document AI calls saved
+blank_crops_dropped = 0
+
+def process_queued_uploads():
+    print("🚀 Segmentation Worker started...")
+    with app.app_context():
+        batch_size = app.config['SEGMENTATION_CLAIM_BATCH_SIZE']
+        idle_timeout = app.config['SEGMENTATION_IDLE_TIMEOUT']
+        listener = QueueListener(db.engine, channel=UPLOAD_QUEUE_CHANNEL)
+        # Created here rather than at import time: spawned pool processes re-import this module
+        executor = SegmentationExecutor(app.config['SEGMENTATION_PROCESSES'])
+        writer = ThreadPoolExecutor(app.config['SEGMENTATION_WRITE_THREADS'])
+        try:
+            while True:
+                # Atomically claim uploads so concurrent workers never segment the same file
+                uploads = claim_uploads(
+                    batch_size,
+                    lease_seconds=app.config['SEGMENTATION_CLAIM_LEASE_SECONDS'],
+                    max_attempts=app.config['SEGMENTATION_MAX_ATTEMPTS']
+                )
+
+                if uploads:
+                    try:
+                        process_uploads(uploads, executor, writer)
+                    except Exception as e:
+                        # e.g. the database went away; the claims expire and the uploads are requeued
+                        print(f"❌ Segmentation batch aborted: {str(e)}")
+                        db.session.rollback()
+                        time.sleep(5)
+                else:
+                    print(f"😴 No uploads to segment. Waiting up to {idle_timeout}s for new uploads...")
+                    listener.wait(idle_timeout)
+        finally:
+            executor.shutdown()
+            writer.shutdown()
+
+def iter_tagged_pages(uploads, failures, pages_read, fully_read):
+    """Yield `(upload, page)` for every page of every upload, recording unreadable uploads in `failures`.
+
+    `pages_read` counts the pages read so far per upload id; ids of uploads
+    whose last page has been read are added to `fully_read`.
+    """
+    for upload in uploads:
+        print(f"📄 Segmenting upload #{upload.upload_id} ({upload.original_filename})")
+        pages_read[upload.upload_id] = 0
+        file_path = get_image_store(app).path(upload.file_path)
+        file_extension = upload.file_path.rsplit('.', 1)[-1].lower()
+        try:
+            for page in iter_upload_pages(file_path, file_extension, dpi=app.config['PDF_RASTER_DPI']):
+                pages_read[upload.upload_id] += 1
+                yield upload, page
+        except Exception as e:
+            failures[upload.upload_id] = e
+        fully_read.add(upload.upload_id)
+
+def is_blank(crop):
+    if not app.config['BLANK_CROP_FILTER_ENABLED']:
+        return False
+    return is_blank_crop(
+        crop,
+        min_stddev=app.config['BLANK_CROP_MIN_STDDEV'],
+        min_ink_ratio=app.config['BLANK_CROP_MIN_INK_RATIO'],
+        min_edge_ratio=app.config['BLANK_CROP_MIN_EDGE_RATIO']
+    )
+
+def store_crop(crop):
+    """Store a crop and, the first time it is seen, its preview thumbnails."""
+    store = get_image_store(app)
+    key, is_new = store.put_image(crop)
+    if is_new and app.config['THUMBNAILS_AT_SEGMENTATION']:
+        store_thumbnails(store, key, crop, fmt=app.config['THUMBNAIL_FORMAT'])
+    return key, is_new
+
+def write_crops(writer, crops, created):
+    """Encode and store crops concurrently; cv2 releases the GIL while encoding.
+
+    Returns the image keys in crop order once every write has finished, since
+    crops may be views into a page that is released when the next page is
+    requested. Keys of newly created blobs are appended to `created`.
+    """
+    futures = [writer.submit(store_crop, crop) for crop in crops]
+
+    keys, error = [], None
+    for future in futures:
+        try:
+            key, is_new = future.result()
+        except Exception as e:
+            error = error or e
+            continue
+        keys.append(key)
+        if is_new:
+            created.append(key)
+
+    if error is not None:
+        raise error
+    return keys
+
+def remove_images(keys):
+    store = get_image_store(app)
+    for key in keys:
+        store.delete(key)
+        delete_thumbnails(store, key, app.config['THUMBNAIL_FORMAT'])
+
+def insert_receipts(rows):
+    """Insert all of an upload's receipts in one multi-row INSERT and return their ids."""
+    if not rows:
+        return []
+    return db.session.scalars(insert(Receipt).returning(Receipt.receipt_id), rows).all()
+
+def process_uploads(uploads, executor, writer):
+    """Segment a claimed batch of uploads and create a Receipt per crop.
+
+    Pages of all the uploads are fanned out across the executor's processes
+    and come back in order, so receipts are created in page order. A
+    failure only fails the upload it came from, and the crop images it
+    created are removed. If segmentation breaks down altogether (e.g. shared
+    memory runs out), uploads already fully segmented are kept, the ones in
+    progress fail and the ones not yet started are requeued. Receipts are
+    inserted and uploads updated in a single commit; if that fails, nothing is kept.
+    """
+    global blank_crops_dropped
+
+    failures = {}
+    rows = {upload.upload_id: [] for upload in uploads}
+    # Only blobs this batch created are removed on failure; deduplicated ones belong to other receipts too
+    created = {upload.upload_id: [] for upload in uploads}
+    blank_counts = {upload.upload_id: 0 for upload in uploads}
+    # An upload is fully segmented once all its pages have been read and have come back
+    pages_read, fully_read = {}, set()
+    pages_segmented = {upload.upload_id: 0 for upload in uploads}
+    requeued = []
+
+    try:
+        for upload, crops, error in executor.segment(iter_tagged_pages(uploads, failures, pages_read, fully_read)):
+            pages_segmented[upload.upload_id] += 1
+            if error is not None:
+                failures.setdefault(upload.upload_id, error)
+            if upload.upload_id in failures:
+                continue
+
+            kept = []
+            for receipt_img in crops:
+                if is_blank(receipt_img):
+                    blank_counts[upload.upload_id] += 1
+                else:
+                    kept.append(receipt_img)
+
+            try:
+                image_keys = write_crops(writer, kept, created[upload.upload_id])
+            except Exception as e:
+                failures[upload.upload_id] = e
+                continue
+
+            rows[upload.upload_id].extend({
+                'user_id': upload.user_id,
+                'batch_id': upload.batch_id,
+                'upload_id': upload.upload_id,
+                'receipt_date': datetime.now(),
+                'total_amount': 99.99,
+                'receipt_image_url': image_key,
+                'is_ocr_extracted': 0
+            } for image_key in image_keys)
+    except Exception as e:
+        print(f"❌ Segmentation aborted: {str(e)}")
+        for upload in uploads:
+            if upload.upload_id not in pages_read:
+                requeued.append(upload)
+            elif upload.upload_id not in fully_read or pages_segmented[upload.upload_id] < pages_read[upload.upload_id]:
+                failures.setdefault(upload.upload_id, e)
+
+    kept_keys = {
+        row['receipt_image_url']
+        for upload_id, upload_rows in rows.items() if upload_id not in failures
+        for row in upload_rows
+    }
+
+    try:
+        for upload in uploads:
+            if upload in requeued:
+                print(f"↩️ Upload #{upload.upload_id} requeued.")
+                upload.status = 'queued'
+                continue
+
+            error = failures.get(upload.upload_id)
+            if error is not None:
+                print(f"❌ Segmentation failed for upload #{upload.upload_id}: {str(error)}")
+                remove_images(key for key in created[upload.upload_id] if key not in kept_keys)
+                upload.status = 'failed'
+                upload.error_message = str(error)
+                continue
+
+            receipt_ids = insert_receipts(rows[upload.upload_id])
+            upload.status = 'done'
+            upload.receipt_count = len(receipt_ids)
+            upload.blank_crop_count = blank_counts[upload.upload_id]
+            print(f"✅ Upload #{upload.upload_id} split into {upload.receipt_count} receipts {receipt_ids} "
+                  f"({upload.blank_crop_count} blank crops dropped).")
+
+        # Hand the new receipts to the OCR workers
+        if any(rows[upload.upload_id] for upload in uploads if upload.upload_id not in failures):
+            notify_receipts_queued()
+        if requeued:
+            notify_uploads_queued()
+        db.session.commit()
+    except Exception as e:
+        print(f"❌ Could not save segmentation results: {str(e)}")
+        db.session.rollback()
+        for upload in uploads:
+            remove_images(created[upload.upload_id])
+            upload.status = 'failed'
+            upload.error_message = str(e)
+        db.session.commit()
+        return
+
+    blank_crops_dropped += sum(blank_counts[upload.upload_id] for upload in uploads if upload.upload_id not in failures)
+    print(f"🧹 {blank_crops_dropped} OCR calls saved by dropping blank crops so far.")
+
+if __name__ == "__main__":
+    process_queued_uploads()
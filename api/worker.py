@@ -1,11 +1,13 @@
-import time
 import os
-from datetime import datetime, timezone
-from sqlalchemy import or_
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from app import create_app, db
-from app.models import Receipt, OcrBase, OcrDetails
-from app.utils.ocr_utils import perform_ocr_with_document_ai
+from app.utils.image_store import get_image_store
+from app.utils.ocr_normalization import get_ocr_normalizer
+from app.utils.ocr_utils import get_ocr_backend, run_ocr
+from app.utils.ocr_persistence import save_ocr_result
+from app.utils.receipt_queue import claim_receipts, schedule_retry, seconds_until_next_retry, QueueListener
+from app.utils.ocr_cache import get_ocr_cache
 
 # Set up Google Cloud credentials
 
@@ -13,96 +15,145 @@ credentials_path = os.path.join('app', 'config', 'quick-receipts-450104-ed1765c7
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
 
 app = create_app()
+ocr_backend = get_ocr_backend(app.config)
+ocr_cache = get_ocr_cache(app.config)
+ocr_normalizer = get_ocr_normalizer(app.config)
 
 def process_queued_receipts():
     print("🚀 OCR Worker started...")
     with app.app_context():
+        batch_size = app.config['OCR_CLAIM_BATCH_SIZE']
+        idle_timeout = app.config['OCR_IDLE_TIMEOUT']
+        listener = QueueListener(db.engine)
         while True:
-            print("🔍 Looking for receipts with 'pending' or 'failed' or 'failed_permanently' status...")
+            print("🔍 Looking for receipts with 'pending' or due 'failed' status...")
 
-            # Find the first receipt that is pending or failed
-            receipt = Receipt.query.filter(
-                or_(Receipt.ocr_status == 'pending',
-                    Receipt.ocr_status == 'failed',
-                    Receipt.ocr_status == 'failed_permanently')
-            ).order_by(Receipt.created_at).first()
-
-            if receipt:
-                print(f"📄 Found receipt #{receipt.receipt_id} (status: {receipt.ocr_status})")
-
-                try:
-                    # Mark the receipt as 'processing'
-                    receipt.ocr_status = 'processing'
-                    receipt.ocr_attempts = (receipt.ocr_attempts or 0) + 1
-                    receipt.last_ocr_attempt = datetime.now(timezone.utc)
+            # Atomically claim a batch of receipts so concurrent workers never share one
+            receipts = claim_receipts(batch_size, **claim_options())
 
+            if receipts:
+                for receipt in receipts:
+                    process_receipt(receipt)
+            else:
+                print(f"😴 No receipts to process. Waiting up to {idle_timeout}s for new uploads...")
+                listener.wait(seconds_until_next_retry(idle_timeout))
+
+def process_queued_receipts_concurrently(max_in_flight):
+    """Keep up to `max_in_flight` Document AI requests running at once.
+
+    OCR calls run on a thread pool; only this (main) thread touches the
+    database, so all result writes go through a single writer.
+    """
+    print(f"🚀 OCR Worker started with {max_in_flight} in-flight requests...")
+    with app.app_context(), ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        idle_timeout = app.config['OCR_IDLE_TIMEOUT']
+        listener = QueueListener(db.engine)
+        in_flight = {}
+        while True:
+            # Top up the pool with newly claimed receipts
+            free_slots = max_in_flight - len(in_flight)
+            if free_slots > 0:
+                for receipt in claim_receipts(free_slots, **claim_options()):
+                    print(f"📄 Claimed receipt #{receipt.receipt_id} (attempt {receipt.ocr_attempts})")
+                    try:
+                        # Identical image bytes are served from the cache without a call out
+                        file_path = receipt_file_path(receipt)
+                        content_hash, cached = lookup_cached_ocr(file_path)
+                        if cached is None:
+                            future = executor.submit(run_ocr, ocr_backend, file_path, ocr_normalizer)
+                            in_flight[future] = (receipt, content_hash)
+                            continue
+                        complete_receipt(receipt, cached)
+                    except Exception as e:
+                        mark_ocr_failed(receipt, e)
                     db.session.commit()
 
-                    # Define the file path for the receipt image
-                    upload_folder = os.path.join(app.root_path, 'uploads', 'receipts')
-                    file_path = os.path.join(upload_folder, receipt.receipt_image_url)
-
-                    # Call the OCR function to extract data from the image
-                    result = perform_ocr_with_document_ai(file_path)
-
-                    # Process the OCR results and update receipt data
-                    receipt.confidence_score = result['avg_confidence']
-                    receipt.is_flagged = result['avg_confidence'] < 0.95
-                    receipt.is_ocr_extracted = True
-                    if result['total_amount'] is not None:
-                        receipt.total_amount = result['total_amount']
-
-                    # Save OCR data to the database
-                    save_ocr_data(receipt.receipt_id, result)
-
-                    # Mark the OCR status as 'done' after successful processing
-                    receipt.ocr_status = 'done'
-                    print(f"✅ Receipt #{receipt.receipt_id} processed successfully.")
+            if not in_flight:
+                print(f"😴 No receipts to process. Waiting up to {idle_timeout}s for new uploads...")
+                listener.wait(seconds_until_next_retry(idle_timeout))
+                continue
 
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                receipt, content_hash = in_flight.pop(future)
+                try:
+                    result = future.result()
+                    store_cached_ocr(content_hash, result)
+                    complete_receipt(receipt, result)
                 except Exception as e:
-                    # Handle any errors and mark the status as 'failed'
-                    print(f"❌ OCR failed for receipt #{receipt.receipt_id}: {str(e)}")
-                    receipt.ocr_status = 'failed'
-                    receipt.ocr_error_message = str(e)
-
-                    # Retry mechanism: Limit to a certain number of attempts (e.g., 3)
-                    if receipt.ocr_attempts >= 3:
-                        receipt.ocr_status = 'failed_permanently'
-                        print(f"❌ OCR failed permanently for receipt #{receipt.receipt_id} after 3 attempts.")
-
+                    mark_ocr_failed(receipt, e)
                 finally:
-                    # Always commit changes, whether the processing was successful or not
                     db.session.commit()
 
-            else:
-                print("😴 No receipts to process. Sleeping 5s...")
-                time.sleep(5)
-
-def save_ocr_data(receipt_id, ocr_data, created_by=3, modified_by=3):
-    # Create the OcrBase entry
-    ocr_base = OcrBase(
-        receipt_id=receipt_id,
-        created_by=created_by,
-        modified_by=modified_by
+def claim_options():
+    return {'lease_seconds': app.config['OCR_CLAIM_LEASE_SECONDS'], 'max_attempts': app.config['OCR_MAX_ATTEMPTS']}
+
+def process_receipt(receipt):
+    print(f"📄 Claimed receipt #{receipt.receipt_id} (attempt {receipt.ocr_attempts})")
+
+    try:
+        # Reuse a cached result for identical image bytes before calling out
+        file_path = receipt_file_path(receipt)
+        content_hash, result = lookup_cached_ocr(file_path)
+        if result is None:
+            # Call the OCR function to extract data from the image
+            result = run_ocr(ocr_backend, file_path, ocr_normalizer)
+            store_cached_ocr(content_hash, result)
+        complete_receipt(receipt, result)
+
+    except Exception as e:
+        mark_ocr_failed(receipt, e)
+
+    finally:
+        # Always commit changes, whether the processing was successful or not
+        db.session.commit()
+
+def lookup_cached_ocr(file_path):
+    if ocr_cache is None:
+        return None, None
+    content_hash = ocr_cache.content_hash(file_path)
+    cached = ocr_cache.get(content_hash)
+    if cached is not None:
+        cached.update(cached=True, latency_ms=0.0)
+    return content_hash, cached
+
+def store_cached_ocr(content_hash, result):
+    if ocr_cache is not None:
+        ocr_cache.put(content_hash, result)
+
+def receipt_file_path(receipt):
+    return get_image_store(app).path(receipt.receipt_image_url)
+
+def complete_receipt(receipt, result):
+    # Receipt update, OcrBase and OcrDetails are written together and committed by the caller
+    save_ocr_result(receipt, result, storage_mode=app.config['OCR_STORAGE_MODE'])
+
+    source = 'cache' if result.get('cached') else f"{result['latency_ms']} ms"
+    normalization = result.get('normalization')
+    if normalization:
+        source += f", {normalization['arm']}, {normalization['bytes_saved'] / 1024:.0f} KB saved"
+    print(f"✅ Receipt #{receipt.receipt_id} processed successfully ({source}).")
+
+def mark_ocr_failed(receipt, error):
+    # Handle any errors and schedule a retry with backoff, or dead-letter the receipt.
+    # Roll back first: a failed flush leaves the session unusable until then.
+    db.session.rollback()
+    print(f"❌ OCR failed for receipt #{receipt.receipt_id}: {str(error)}")
+
+    delay = schedule_retry(
+        receipt, error,
+        max_attempts=app.config['OCR_MAX_ATTEMPTS'],
+        base_delay=app.config['OCR_RETRY_BASE_DELAY'],
+        max_delay=app.config['OCR_RETRY_MAX_DELAY']
     )
-    db.session.add(ocr_base)
-    db.session.commit()
-
-    # Create the OcrDetails entries
-    for result in ocr_data['ocr_results']:
-        ocr_detail = OcrDetails(
-            ocr_base_id=ocr_base.ocr_base_id,
-            field_type=result['type'],
-            text_value=result['text_value'],
-            normalized_value=result['normalized_value'],
-            confidence=result['confidence']
-        )
-        db.session.add(ocr_detail)
-
-    db.session.commit()
-
-    return ocr_base.ocr_base_id  # Return the OcrBase ID if needed
-
+    if delay is None:
+        print(f"☠️ Receipt #{receipt.receipt_id} moved to dead letter after {receipt.ocr_attempts} attempts.")
+    else:
+        print(f"🔁 Retrying receipt #{receipt.receipt_id} in {delay:.0f}s.")
 
 if __name__ == "__main__":
-    process_queued_receipts()
+    max_in_flight = app.config['OCR_MAX_IN_FLIGHT']
+    if max_in_flight > 1:
+        process_queued_receipts_concurrently(max_in_flight)
+    else:
+        process_queued_receipts()